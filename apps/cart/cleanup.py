@@ -0,0 +1,161 @@
+"""
+Removal of abandoned anonymous carts and expired sessions.
+
+Rows are deleted in small batches in primary key order, each batch in its
+own short transaction with a pause in between, so the cleanup never holds
+locks for long while shoppers are using the site.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .models import Cart, CartItem, CleanupLease
+
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_LEASE_ID = 1
+
+
+class CleanupStats:
+    """Counters of one cleanup run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        rate = self.rows / self.seconds if self.seconds else 0
+        return f'{self.name}: {self.rows} rows in {self.batches} batches, {self.seconds:.1f}s ({rate:.0f} rows/s)'
+
+
+def abandoned_carts(ttl_days=None):
+    """
+    Anonymous carts idle for longer than the TTL that nobody can reach.
+
+    A cart is abandoned when it is empty or when its session no longer
+    exists or has expired.
+    """
+    ttl_days = settings.CART_TTL_DAYS if ttl_days is None else ttl_days
+    now = timezone.now()
+    live_session = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gt=now)
+    return (
+        Cart.objects.filter(user__isnull=True, updated_at__lt=now - timedelta(days=ttl_days))
+        .exclude(Exists(live_session) & Exists(CartItem.objects.filter(cart=OuterRef('pk'))))
+    )
+
+
+def expired_sessions():
+    return Session.objects.filter(expire_date__lt=timezone.now())
+
+
+def delete_in_batches(queryset, stats, batch_size=None, delay=None, dry_run=False):
+    """
+    Delete the rows of a queryset batch by batch in primary key order.
+
+    With dry_run the rows are only counted.
+    """
+    batch_size = batch_size or settings.CART_CLEANUP_BATCH_SIZE
+    delay = settings.CART_CLEANUP_BATCH_DELAY if delay is None else delay
+    start = time.monotonic()
+    pk_name = queryset.model._meta.pk.name
+    last_pk = None
+
+    while True:
+        batch = queryset.order_by(pk_name)
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list(pk_name, flat=True)[:batch_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+
+        if dry_run:
+            stats.rows += len(pks)
+        else:
+            with transaction.atomic():
+                # The queryset's conditions are checked again, so rows that
+                # changed since they were selected (a cart touched by an add
+                # or a login merge) are kept; cascades to the cart items
+                deleted, per_model = queryset.filter(pk__in=pks).delete()
+            stats.rows += per_model.get(queryset.model._meta.label, 0)
+            if delay:
+                time.sleep(delay)
+        stats.batches += 1
+
+    stats.seconds += time.monotonic() - start
+    return stats
+
+
+def run_cleanup(ttl_days=None, batch_size=None, delay=None, dry_run=False):
+    """Delete abandoned carts, then expired sessions; return the stats of both"""
+    carts = delete_in_batches(abandoned_carts(ttl_days), CleanupStats('carts'), batch_size, delay, dry_run)
+    sessions = delete_in_batches(expired_sessions(), CleanupStats('sessions'), batch_size, delay, dry_run)
+    return [carts, sessions]
+
+
+def in_business_hours():
+    start, end = settings.CART_CLEANUP_BUSINESS_HOURS
+    return start <= timezone.localtime().hour < end
+
+
+def acquire_cleanup_lease(seconds):
+    """
+    Take the cleanup lease for the given number of seconds, if nobody holds it.
+
+    The lease is a database row, so it is shared by every worker process; the
+    conditional UPDATE lets exactly one of them win when several try at once.
+    """
+    now = timezone.now()
+    CleanupLease.objects.get_or_create(pk=CLEANUP_LEASE_ID, defaults={'locked_until': now})
+    leases = CleanupLease.objects.filter(pk=CLEANUP_LEASE_ID, locked_until__lte=now)
+    return leases.update(locked_until=now + timedelta(seconds=seconds)) == 1
+
+
+def renew_cleanup_lease(seconds):
+    """Keep the lease for the given number of seconds from now"""
+    CleanupLease.objects.filter(pk=CLEANUP_LEASE_ID).update(locked_until=timezone.now() + timedelta(seconds=seconds))
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def periodic_cleanup(interval):
+    while True:
+        time.sleep(interval)
+        if in_business_hours():
+            continue
+        try:
+            # Only one worker process cleans up per interval
+            if not acquire_cleanup_lease(interval):
+                continue
+            for stats in run_cleanup():
+                logger.info('Cart cleanup %s', stats)
+            # A run can take longer than the interval; the next one starts a
+            # full interval after this one finished
+            renew_cleanup_lease(interval)
+        except Exception:
+            logger.exception('Cart cleanup failed')
+        finally:
+            # The thread has its own connection; don't keep it open while sleeping
+            connection.close()
+
+
+def start_periodic_cleanup():
+    """Start the in-process cleanup thread if CART_CLEANUP_INTERVAL is set"""
+    global _runner
+    interval = settings.CART_CLEANUP_INTERVAL
+    if not interval or _runner is not None:
+        return
+    with _runner_lock:
+        if _runner is None:
+            _runner = threading.Thread(target=periodic_cleanup, args=(interval,), name='cart-cleanup', daemon=True)
+            _runner.start()
@@ -1,24 +1,38 @@
-from .models import Cart
+from django.db.models import Sum
+from .models import CartItem
+
+
+def get_cart_item_count(request):
+    """Number of items in the visitor's cart, computed once per request"""
+    # Reuse the summary if the view already computed one for this request
+    summary = getattr(request, '_cart_summary', None)
+    if summary is not None:
+        return summary.item_count
+    
+    if not hasattr(request, '_cart_item_count'):
+        count = 0
+        
+        if request.user.is_authenticated:
+            items = CartItem.objects.filter(cart__user=request.user)
+        elif request.session.session_key:
+            items = CartItem.objects.filter(cart__session_key=request.session.session_key)
+        else:
+            items = None
+        
+        if items is not None:
+            count = items.aggregate(total=Sum('quantity'))['total'] or 0
+        request._cart_item_count = count
+    return request._cart_item_count
 
 
 def cart_count(request):
     """Add cart item count to all templates"""
-    count = 0
-    
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            count = 0
-    elif request.session.session_key:
-        try:
-            cart = Cart.objects.get(session_key=request.session.session_key)
-            count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            count = 0
+    # Pages of anonymous visitors are cached; their badge is filled in client-side
+    if not request.user.is_authenticated:
+        return {
+            'cart_item_count': None
+        }
     
     return {
-        'cart_item_count': count
+        'cart_item_count': get_cart_item_count(request)
     }
-
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.cart.cleanup import run_cleanup
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned anonymous carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=settings.CART_TTL_DAYS, help='Days a cart has to be idle')
+        parser.add_argument('--batch-size', type=int, default=settings.CART_CLEANUP_BATCH_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--delay', type=float, default=settings.CART_CLEANUP_BATCH_DELAY, help='Seconds to wait between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing will be deleted')
+        self.stdout.write(f'Cleaning up carts idle for more than {options["ttl_days"]} days...')
+        
+        results = run_cleanup(
+            ttl_days=options['ttl_days'],
+            batch_size=options['batch_size'],
+            delay=options['delay'],
+            dry_run=options['dry_run'],
+        )
+        
+        for stats in results:
+            self.stdout.write(f'  {stats}')
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {verb} {results[0].rows} carts and {results[1].rows} sessions'
+        ))
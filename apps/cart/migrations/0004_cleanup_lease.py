@@ -0,0 +1,20 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_cart_session_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleanupLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('locked_until', models.DateTimeField(help_text='Other processes skip the cleanup until then')),
+            ],
+        ),
+    ]
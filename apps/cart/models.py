@@ -1,12 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_started
+from django.dispatch import receiver
 from apps.products.models import Product
 
 
 class Cart(models.Model):
     """Shopping cart for users (authenticated or session-based)"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
-    session_key = models.CharField(max_length=40, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -15,25 +18,50 @@ class Cart(models.Model):
             return f"Cart for {self.user.username}"
         return f"Cart (session: {self.session_key})"
     
+    def get_summary(self):
+        """Build a CartSummary from a single joined query"""
+        if self.pk is None:
+            # Carts are only saved when the first product is added
+            return CartSummary(self, [])
+        items = list(self.items.select_related('product', 'product__category'))
+        return CartSummary(self, items)
+    
     def get_total(self):
         """Calculate total cart value (with discounts applied)"""
-        return sum(item.get_subtotal() for item in self.items.all())
+        return self.get_summary().total
     
     def get_original_total(self):
         """Calculate total cart value before discounts"""
-        return sum(item.product.price * item.quantity for item in self.items.all())
+        return self.get_summary().original_total
     
     def get_total_discount(self):
         """Calculate total discount amount"""
-        return sum(item.get_total_discount() for item in self.items.all())
+        return self.get_summary().total_discount
     
     def has_discounts(self):
         """Check if cart has any discounted items"""
-        return any(item.discount_percentage > 0 for item in self.items.all())
+        return self.get_summary().has_discounts
     
     def get_item_count(self):
         """Get total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.get_summary().item_count
+
+
+class CartSummary:
+    """Totals for a cart computed once from already loaded items"""
+    
+    def __init__(self, cart, items):
+        self.cart = cart
+        self.items = items
+        self.total = sum(item.get_subtotal() for item in items)
+        self.original_total = sum(item.product.price * item.quantity for item in items)
+        self.total_discount = sum(item.get_total_discount() for item in items)
+        self.has_discounts = any(item.discount_percentage > 0 for item in items)
+        self.item_count = sum(item.quantity for item in items)
+    
+    @property
+    def is_empty(self):
+        return not self.items
 
 
 class CartItem(models.Model):
@@ -68,3 +96,24 @@ class CartItem(models.Model):
             discounted_total = self.get_subtotal()
             return original_total - discounted_total
         return 0
+
+
+class CleanupLease(models.Model):
+    """Single row that lets one worker process at a time run the periodic cleanup"""
+    locked_until = models.DateTimeField(help_text="Other processes skip the cleanup until then")
+
+
+@receiver(request_started)
+def start_cart_cleanup(sender, **kwargs):
+    """Start the optional periodic cart cleanup in web processes"""
+    from .cleanup import start_periodic_cleanup
+    start_periodic_cleanup()
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    """Move the cart the visitor filled before logging in into their own cart"""
+    cart_id = request.session.pop('cart_id', None) if request is not None else None
+    if cart_id is not None:
+        from .services import merge_carts
+        merge_carts(cart_id, user)
@@ -0,0 +1,135 @@
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Cart, CartItem
+
+
+def touch_cart(cart_id):
+    """Mark a cart as used now, so the cleanup measures its TTL from this change"""
+    Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+
+def add_items(cart_id, lines):
+    """
+    Add (product_id, quantity, discount_percentage) lines to a cart.
+
+    Products already in the cart get the quantity added and keep the better
+    of the two discounts. On PostgreSQL and SQLite this is a single
+    INSERT ... ON CONFLICT DO UPDATE, so concurrent adds never lose an
+    increment; the cart's updated_at moves in the same transaction.
+    Returns {product_id: quantity now in the cart}.
+    """
+    if not lines:
+        return {}
+    if not connection.features.supports_update_conflicts_with_target:
+        return _add_items_locked(cart_id, lines)
+
+    table = CartItem._meta.db_table
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(lines))
+    params = []
+    for product_id, quantity, discount in lines:
+        params += [cart_id, product_id, quantity, connection.ops.adapt_decimalfield_value(Decimal(str(discount)), 5, 2), added_at]
+
+    returning = connection.features.can_return_rows_from_bulk_insert
+    sql = f"""
+        INSERT INTO {table} (cart_id, product_id, quantity, discount_percentage, added_at)
+        VALUES {values}
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET
+            quantity = {table}.quantity + excluded.quantity,
+            discount_percentage = {greatest}({table}.discount_percentage, excluded.discount_percentage)
+        {'RETURNING product_id, quantity' if returning else ''}
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if returning else None
+        touch_cart(cart_id)
+    if returning:
+        return dict(rows)
+    return dict(
+        CartItem.objects.filter(cart_id=cart_id, product_id__in=[line[0] for line in lines])
+        .values_list('product_id', 'quantity')
+    )
+
+
+def _add_items_locked(cart_id, lines):
+    """Row-locking fallback for databases without ON CONFLICT"""
+    quantities = {}
+    with transaction.atomic():
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(
+                cart_id=cart_id, product_id__in=[line[0] for line in lines]
+            )
+        }
+        for product_id, quantity, discount in lines:
+            item = existing.get(product_id)
+            if item is None:
+                CartItem.objects.create(
+                    cart_id=cart_id, product_id=product_id, quantity=quantity, discount_percentage=discount
+                )
+                quantities[product_id] = quantity
+            else:
+                CartItem.objects.filter(pk=item.pk).update(
+                    quantity=F('quantity') + quantity,
+                    discount_percentage=max(item.discount_percentage, discount),
+                )
+                quantities[product_id] = item.quantity + quantity
+        touch_cart(cart_id)
+    return quantities
+
+
+def change_quantity(cart_id, item_id, change):
+    """
+    Add a (possibly negative) change to a cart line in one UPDATE.
+
+    A line that would drop to zero is removed instead. Returns the new
+    quantity, 0 when the line was removed, or None when there is no such line.
+    """
+    items = CartItem.objects.filter(pk=item_id, cart_id=cart_id)
+    with transaction.atomic():
+        if items.filter(quantity__gt=-change).update(quantity=F('quantity') + change):
+            quantity = items.values_list('quantity', flat=True).first()
+        elif change < 0 and items.delete()[0]:
+            quantity = 0
+        else:
+            return None
+        touch_cart(cart_id)
+    return quantity
+
+
+def set_quantity(cart_id, item_id, quantity):
+    """Set a cart line's quantity, removing it at zero; same return values as change_quantity"""
+    items = CartItem.objects.filter(pk=item_id, cart_id=cart_id)
+    with transaction.atomic():
+        changed = items.update(quantity=quantity) if quantity > 0 else items.delete()[0]
+        if not changed:
+            return None
+        touch_cart(cart_id)
+    return max(quantity, 0)
+
+
+def merge_carts(cart_id, user):
+    """
+    Fold an anonymous cart into the user's cart and delete it.
+
+    Quantities of products in both carts are summed and the better discount
+    is kept. Runs in one transaction with the same number of queries for
+    any number of items.
+    """
+    with transaction.atomic():
+        anonymous = Cart.objects.select_for_update().filter(pk=cart_id, user__isnull=True).first()
+        if anonymous is None:
+            return None
+        
+        user_cart, created = Cart.objects.get_or_create(user=user)
+        lines = list(
+            CartItem.objects.filter(cart_id=anonymous.pk)
+            .values_list('product_id', 'quantity', 'discount_percentage')
+        )
+        add_items(user_cart.pk, lines)
+        anonymous.delete()
+    return user_cart
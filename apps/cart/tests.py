@@ -1,3 +1,227 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.products.models import Category, Product
+from .cleanup import CleanupStats, abandoned_carts, acquire_cleanup_lease, delete_in_batches
+from .models import Cart, CartItem, CleanupLease
+from .services import add_items, change_quantity, merge_carts, set_quantity, touch_cart
 
-# Create your tests here.
+
+class CartLineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.suit = Product.objects.create(
+            name='Oxford', category=category, price=15000, size='50', color='црна',
+            stock_quantity=5, image_path='suits/Oxford.jpg',
+        )
+        cls.tie = Product.objects.create(
+            name='Tie', category=category, price=2000, size='универзална', color='црна',
+            stock_quantity=5, image_path='accessories/Tie.jpg',
+        )
+
+    def setUp(self):
+        self.cart = Cart.objects.create(session_key='shopper')
+
+    def lines(self):
+        return {
+            product_id: (quantity, discount)
+            for product_id, quantity, discount in self.cart.items.values_list('product_id', 'quantity', 'discount_percentage')
+        }
+
+    def test_add_items_adds_up_and_keeps_the_better_discount(self):
+        self.assertEqual(add_items(self.cart.pk, [(self.suit.pk, 1, 0), (self.tie.pk, 2, 15)]), {self.suit.pk: 1, self.tie.pk: 2})
+        self.assertEqual(add_items(self.cart.pk, [(self.suit.pk, 2, 10), (self.tie.pk, 1, 5)]), {self.suit.pk: 3, self.tie.pk: 3})
+        self.assertEqual(self.lines(), {self.suit.pk: (3, Decimal('10')), self.tie.pk: (3, Decimal('15'))})
+
+    def test_add_items_writes_every_line_in_one_statement(self):
+        with CaptureQueriesContext(connection) as one_line:
+            add_items(self.cart.pk, [(self.suit.pk, 1, 0)])
+        with CaptureQueriesContext(connection) as two_lines:
+            add_items(self.cart.pk, [(self.suit.pk, 1, 0), (self.tie.pk, 1, 0)])
+        self.assertEqual(len(two_lines), len(one_line))
+        self.assertEqual(sum('ON CONFLICT' in query['sql'] for query in two_lines), 1)
+
+    def test_change_quantity_removes_a_line_that_would_drop_to_zero(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.suit, quantity=2)
+        self.assertEqual(change_quantity(self.cart.pk, item.pk, 1), 3)
+        self.assertEqual(change_quantity(self.cart.pk, item.pk, -2), 1)
+        self.assertEqual(change_quantity(self.cart.pk, item.pk, -5), 0)
+        self.assertFalse(CartItem.objects.filter(pk=item.pk).exists())
+        # Gone lines and lines of other carts are left alone
+        self.assertIsNone(change_quantity(self.cart.pk, item.pk, 1))
+        other = CartItem.objects.create(cart=Cart.objects.create(session_key='other'), product=self.tie)
+        self.assertIsNone(set_quantity(self.cart.pk, other.pk, 4))
+        self.assertEqual(CartItem.objects.get(pk=other.pk).quantity, 1)
+
+
+class MergeCartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {i}', category=category, price=1000, size='50', color='црна',
+                stock_quantity=5, image_path=f'suits/{i}.jpg',
+            )
+            for i in range(5)
+        ]
+
+    def anonymous_cart(self, lines):
+        cart = Cart.objects.create(session_key=f'anonymous-{Cart.objects.count()}')
+        add_items(cart.pk, lines)
+        return cart
+
+    def test_lines_are_summed_with_the_better_discount(self):
+        user = User.objects.create_user('ana')
+        first, second = self.products[:2]
+        add_items(Cart.objects.create(user=user).pk, [(first.pk, 1, 20)])
+        anonymous = self.anonymous_cart([(first.pk, 2, 10), (second.pk, 1, 0)])
+
+        user_cart = merge_carts(anonymous.pk, user)
+
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+        self.assertEqual(
+            set(user_cart.items.values_list('product_id', 'quantity', 'discount_percentage')),
+            {(first.pk, 3, Decimal('20')), (second.pk, 1, Decimal('0'))},
+        )
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        counts = []
+        for size in (1, 5):
+            user = User.objects.create_user(f'user-{size}')
+            anonymous = self.anonymous_cart([(product.pk, 1, 0) for product in self.products[:size]])
+            with CaptureQueriesContext(connection) as queries:
+                merge_carts(anonymous.pk, user)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_login_merges_the_session_cart(self):
+        User.objects.create_user('ana', password='secret')
+        self.client.post(reverse('cart:add_to_cart', args=[self.products[0].pk]))
+        self.assertTrue(self.client.login(username='ana', password='secret'))
+        cart = Cart.objects.get()
+        self.assertEqual(cart.user.username, 'ana')
+        self.assertEqual(list(cart.items.values_list('product_id', flat=True)), [self.products[0].pk])
+
+
+class CartActivityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.product = Product.objects.create(
+            name='Oxford', category=category, price=15000, size='50', color='црна',
+            stock_quantity=2, image_path='suits/Oxford.jpg',
+        )
+
+    def setUp(self):
+        self.cart = Cart.objects.create(session_key='idle')
+        self.long_ago = timezone.now() - timedelta(days=60)
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=self.long_ago)
+
+    def assertTouched(self):
+        self.cart.refresh_from_db()
+        self.assertGreater(self.cart.updated_at, self.long_ago)
+        self.assertNotIn(self.cart, abandoned_carts(ttl_days=30))
+
+    def test_adding_items_keeps_the_cart_alive(self):
+        add_items(self.cart.pk, [(self.product.pk, 1, 0)])
+        self.assertTouched()
+
+    def test_changing_quantities_keeps_the_cart_alive(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=self.long_ago)
+        self.assertEqual(change_quantity(self.cart.pk, item.pk, 1), 2)
+        self.assertTouched()
+
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=self.long_ago)
+        self.assertEqual(set_quantity(self.cart.pk, item.pk, 0), 0)
+        self.assertTouched()
+
+    def test_missing_line_changes_nothing(self):
+        self.assertIsNone(change_quantity(self.cart.pk, 0, 1))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.updated_at, self.long_ago)
+
+
+class CleanupTests(TestCase):
+
+    def setUp(self):
+        self.session = SessionStore()
+        self.session.create()
+        long_ago = timezone.now() - timedelta(days=60)
+        self.idle = Cart.objects.create(session_key='gone')
+        self.active = Cart.objects.create(session_key=self.session.session_key)
+        Cart.objects.update(updated_at=long_ago)
+
+    def test_cart_touched_after_it_was_selected_is_kept(self):
+        atomic = transaction.atomic
+
+        def add_to_cart_meanwhile(*args, **kwargs):
+            # A shopper adds to the cart between the select and the delete
+            touch_cart(self.active.pk)
+            return atomic(*args, **kwargs)
+
+        stats = CleanupStats('carts')
+        with mock.patch('apps.cart.cleanup.transaction.atomic', add_to_cart_meanwhile):
+            delete_in_batches(abandoned_carts(ttl_days=30), stats, delay=0)
+
+        self.assertEqual(stats.rows, 1)
+        self.assertQuerySetEqual(Cart.objects.all(), [self.active])
+
+
+class CleanupLeaseTests(TestCase):
+
+    def test_one_holder_per_interval(self):
+        self.assertTrue(acquire_cleanup_lease(60))
+        # Another worker process tries while the lease is held
+        self.assertFalse(acquire_cleanup_lease(60))
+
+        CleanupLease.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_cleanup_lease(60))
+
+
+class CartFragmentTests(TestCase):
+    """Cart forms posted by the page script get JSON fragments instead of a redirect"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.product = Product.objects.create(
+            name='Oxford', category=category, price=15000, size='50', color='црна',
+            stock_quantity=5, image_path='suits/Oxford.jpg',
+        )
+
+    def post(self, url, data=None):
+        return self.client.post(url, data or {}, HTTP_ACCEPT='application/json')
+
+    def test_add_returns_the_line_and_the_totals(self):
+        data = self.post(reverse('cart:add_to_cart', args=[self.product.pk])).json()
+
+        item = CartItem.objects.get()
+        self.assertEqual((data['count'], data['item_id'], data['empty'], data['level']), (1, item.pk, False, 'success'))
+        self.assertIn(f'data-cart-line="{item.pk}"', data['line_html'])
+        self.assertIn('15', data['summary_html'])
+        self.assertNotIn('<html', data['line_html'] + data['summary_html'])
+
+    def test_removing_the_last_line_reports_an_empty_cart(self):
+        self.post(reverse('cart:add_to_cart', args=[self.product.pk]))
+        item = CartItem.objects.get()
+
+        data = self.post(reverse('cart:update_cart_item', args=[item.pk]), {'change': '-1'}).json()
+
+        self.assertEqual((data['count'], data['empty'], data['item_id'], data['line_html']), (0, True, item.pk, None))
+
+    def test_plain_form_posts_still_redirect(self):
+        response = self.client.post(reverse('cart:add_to_cart', args=[self.product.pk]))
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
@@ -5,6 +5,7 @@ app_name = 'cart'
 
 urlpatterns = [
     path('', views.cart_detail, name='cart_detail'),
+    path('count/', views.cart_count, name='cart_count'),
     path('add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
@@ -1,9 +1,16 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
 from apps.products.models import Product
-from apps.recommendations.models import RecommendationRule
+from apps.recommendations.copurchase import bought_together_with
+from apps.recommendations.index import get_recommendation_index
+from .context_processors import get_cart_item_count
 from .models import Cart, CartItem
+from .services import add_items, change_quantity, set_quantity
 
 
 def get_or_create_cart(request):
@@ -14,95 +21,118 @@ def get_or_create_cart(request):
         if not request.session.session_key:
             request.session.create()
         cart, created = Cart.objects.get_or_create(session_key=request.session.session_key)
+        # The session key changes on login; the id lets the cart be merged then
+        if request.session.get('cart_id') != cart.pk:
+            request.session['cart_id'] = cart.pk
     return cart
 
 
+def get_cart(request):
+    """
+    Get cart for user or session without creating one.
+
+    Visitors without a cart get an empty unsaved one, so browsing the cart
+    doesn't write anything; it is saved by the first add_to_cart.
+    """
+    if request.user.is_authenticated:
+        cart = Cart.objects.filter(user=request.user).first()
+        return cart or Cart(user=request.user)
+    
+    session_key = request.session.session_key
+    cart = Cart.objects.filter(session_key=session_key).first() if session_key else None
+    return cart or Cart(session_key=session_key)
+
+
+def get_cart_summary(request):
+    """Get the cart summary for this request, computing it only once"""
+    if not hasattr(request, '_cart_summary'):
+        request._cart_summary = get_cart(request).get_summary()
+    return request._cart_summary
+
+
+# Standard delivery (mock estimate)
+DELIVERY_COST = 200
+
+
+def summary_context(summary):
+    """Template context of the cart totals"""
+    return {
+        'subtotal': summary.total,
+        'original_subtotal': summary.original_total,
+        'total_discount': summary.total_discount,
+        'has_discounts': summary.has_discounts,
+        'delivery_cost': DELIVERY_COST,
+        'total': summary.total + DELIVERY_COST,
+    }
+
+
+def wants_json(request):
+    """Cart forms submitted by the page script ask for JSON"""
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+def cart_response(request, message, level=messages.SUCCESS, cart=None, item_id=None, product_id=None):
+    """
+    Finish a cart change: redirect to the cart with a flash message, or for
+    script requests return the message, the changed line and the new totals
+    as JSON, without the rest of the cart page.
+    """
+    if not wants_json(request):
+        messages.add_message(request, level, message)
+        return redirect('cart:cart_detail')
+    
+    data = {
+        'message': message,
+        'level': messages.DEFAULT_TAGS[level],
+    }
+    if cart is not None and cart.pk is not None:
+        summary = cart.get_summary()
+        line = next(
+            (item for item in summary.items if item.pk == item_id or item.product_id == product_id),
+            None,
+        )
+        data.update({
+            'count': summary.item_count,
+            'empty': summary.is_empty,
+            'item_id': line.pk if line else item_id,
+            'line_html': render_to_string('cart/cart_item.html', {'item': line}, request) if line else None,
+            'summary_html': render_to_string('cart/cart_summary.html', summary_context(summary), request),
+        })
+    return JsonResponse(data)
+
+
+@require_safe
+def cart_count(request):
+    """Cart item count for the badge and a CSRF token for the forms on cached pages"""
+    response = JsonResponse({'count': get_cart_item_count(request), 'csrf_token': get_token(request)})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 def cart_detail(request):
     """Display shopping cart"""
-    cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
+    summary = get_cart_summary(request)
+    cart = summary.cart
+    cart_items = summary.items
     
     # Get recommendations based on cart contents
-    from decimal import Decimal
-    recommended_products = []
-    if cart_items.exists():
-        # Get categories in cart
-        categories_in_cart = set(item.product.category for item in cart_items)
-        
-        # Find active recommendation rules
-        rules = RecommendationRule.objects.filter(
-            is_active=True,
-            trigger_category__in=categories_in_cart
-        )
-        
-        product_ids_in_cart = [item.product.id for item in cart_items]
-        
-        for rule in rules:
-            # Get recommended products from categories or specific products
-            if rule.recommended_categories.exists():
-                # Get products from recommended categories
-                for category in rule.recommended_categories.all():
-                    products = Product.objects.filter(
-                        category=category,
-                        availability=True
-                    ).exclude(id__in=product_ids_in_cart)[:4]
-                    
-                    for product in products:
-                        discount_multiplier = (Decimal('100') - rule.discount_percentage) / Decimal('100')
-                        discounted_price = product.price * discount_multiplier
-                        savings = product.price - discounted_price
-                        
-                        recommended_products.append({
-                            'product': product,
-                            'discount': rule.discount_percentage,
-                            'discounted_price': discounted_price,
-                            'savings': savings,
-                        })
-            
-            # Also check for specific recommended products
-            for product in rule.recommended_products.filter(availability=True).exclude(id__in=product_ids_in_cart):
-                discount_multiplier = (Decimal('100') - rule.discount_percentage) / Decimal('100')
-                discounted_price = product.price * discount_multiplier
-                savings = product.price - discounted_price
-                
-                recommended_products.append({
-                    'product': product,
-                    'discount': rule.discount_percentage,
-                    'discounted_price': discounted_price,
-                    'savings': savings,
-                })
-    
-    # Calculate delivery estimate (mock)
-    delivery_cost = 200  # Standard delivery
-    
-    # Separate accessories from other recommended products
     recommended_accessories = []
     recommended_other = []
-    
-    for rec in recommended_products:
-        product_category = rec['product'].category.slug if rec['product'].category else ''
-        if 'accessor' in product_category.lower() or 'додато' in (rec['product'].category.name_mk or '').lower():
-            recommended_accessories.append(rec)
-        else:
-            recommended_other.append(rec)
-    
-    # Calculate discount totals
-    subtotal = cart.get_total()
-    original_total = cart.get_original_total()
-    total_discount = cart.get_total_discount()
-    has_discounts = cart.has_discounts()
+    bought_together = []
+    if cart_items:
+        recommended_accessories, recommended_other = get_recommendation_index().recommend(cart_items)
+        bought_together = bought_together_with(
+            [item.product_id for item in cart_items],
+            exclude=[rec['product'].pk for rec in recommended_accessories + recommended_other],
+        )
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
-        'subtotal': subtotal,
-        'original_subtotal': original_total,
-        'total_discount': total_discount,
-        'has_discounts': has_discounts,
-        'delivery_cost': delivery_cost,
-        'total': subtotal + delivery_cost,
-        'recommended_accessories': recommended_accessories[:4],  # Show max 4 accessory recommendations
-        'recommended_products': recommended_other[:4],  # Show max 4 other recommendations
+        **summary_context(summary),
+        'recommended_accessories': recommended_accessories,  # Max 4 accessory recommendations
+        'recommended_products': recommended_other,  # Max 4 other recommendations
+        'bought_together': bought_together,
     }
     return render(request, 'cart/cart_detail.html', context)
 
@@ -131,30 +161,17 @@ def add_to_cart(request, product_id):
         elif discount_percentage > 100:
             discount_percentage = Decimal('100')
         
-        # Check if product already in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'discount_percentage': discount_percentage}
-        )
+        # One upsert: adds the line or bumps its quantity, keeping the better discount
+        quantity = add_items(cart.pk, [(product.pk, 1, discount_percentage)])[product.pk]
         
-        if not created:
-            cart_item.quantity += 1
-            # Update discount if a better discount is provided
-            if discount_percentage > cart_item.discount_percentage:
-                cart_item.discount_percentage = discount_percentage
-            cart_item.save()
-            if discount_percentage > 0 and discount_percentage > cart_item.discount_percentage:
-                messages.success(request, f'Количината на {product.name} е зголемена и попустот е ажуриран!')
-            else:
-                messages.success(request, f'Количината на {product.name} е зголемена.')
+        if quantity > 1:
+            message = f'Количината на {product.name} е зголемена.'
+        elif discount_percentage > 0:
+            message = f'{product.name} е додаден во кошничката со {discount_percentage:.0f}% попуст!'
         else:
-            if discount_percentage > 0:
-                messages.success(request, f'{product.name} е додаден во кошничката со {discount_percentage:.0f}% попуст!')
-            else:
-                messages.success(request, f'{product.name} е додаден во кошничката.')
+            message = f'{product.name} е додаден во кошничката.'
         
-        return redirect('cart:cart_detail')
+        return cart_response(request, message, cart=cart, product_id=product.pk)
     
     return redirect('products:home')
 
@@ -162,20 +179,25 @@ def add_to_cart(request, product_id):
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
     if request.method == 'POST':
-        cart = get_or_create_cart(request)
-        cart_item = get_object_or_404(CartItem, pk=item_id, cart=cart)
+        cart = get_cart(request)
         
-        quantity = int(request.POST.get('quantity', 1))
+        # The +/- buttons send a change, the number input the new quantity
+        try:
+            if 'change' in request.POST:
+                quantity = change_quantity(cart.pk, item_id, int(request.POST['change']))
+            else:
+                quantity = set_quantity(cart.pk, item_id, int(request.POST.get('quantity', 1)))
+        except ValueError:
+            return redirect('cart:cart_detail')
         
+        if quantity is None:
+            raise Http404('No CartItem matches the given query.')
         if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-            messages.success(request, 'Количината е ажурирана.')
+            message = 'Количината е ажурирана.'
         else:
-            cart_item.delete()
-            messages.success(request, 'Производот е отстранет од кошничката.')
+            message = 'Производот е отстранет од кошничката.'
         
-        return redirect('cart:cart_detail')
+        return cart_response(request, message, cart=cart, item_id=item_id)
     
     return redirect('cart:cart_detail')
 
@@ -183,11 +205,11 @@ def update_cart_item(request, item_id):
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
     if request.method == 'POST':
-        cart = get_or_create_cart(request)
-        cart_item = get_object_or_404(CartItem, pk=item_id, cart=cart)
+        cart = get_cart(request)
+        cart_item = get_object_or_404(CartItem.objects.select_related('product'), pk=item_id, cart_id=cart.pk)
         product_name = cart_item.product.name
-        cart_item.delete()
-        messages.success(request, f'{product_name} е отстранет од кошничката.')
+        CartItem.objects.filter(pk=cart_item.pk).delete()
+        return cart_response(request, f'{product_name} е отстранет од кошничката.', cart=cart, item_id=item_id)
     
     return redirect('cart:cart_detail')
 
@@ -199,8 +221,8 @@ def apply_coupon(request):
         
         # Mock coupon validation
         if coupon_code.upper() == 'WELCOME10':
-            messages.success(request, 'Купонот е применет! Добивте 10% попуст.')
+            return cart_response(request, 'Купонот е применет! Добивте 10% попуст.')
         elif coupon_code:
-            messages.error(request, 'Невалиден купон.')
+            return cart_response(request, 'Невалиден купон.', messages.ERROR)
         
     return redirect('cart:cart_detail')
@@ -51,8 +51,14 @@ class Order(models.Model):
     # Notes
     notes = models.TextField(blank=True, verbose_name="Забелешки")
     
+    # Checkout token of the payment form, so a resubmitted form doesn't order twice
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='orders_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.first_name} {self.last_name}"
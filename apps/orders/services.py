@@ -0,0 +1,152 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+from apps.cart.models import Cart, CartItem, CartSummary
+from apps.delivery.models import Delivery, DeliveryStatusHistory
+from apps.products.models import Product, catalog_changed
+from .models import Order, OrderItem
+
+
+class EmptyCartError(Exception):
+    """The cart was emptied (e.g. by another checkout) before the order was placed"""
+
+
+class OutOfStockError(Exception):
+    """Some cart lines ask for more pieces than are left"""
+    
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages  # list of (cart item, pieces left)
+
+
+def get_placed_order(idempotency_key):
+    """Order already placed with this checkout token, if any"""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(idempotency_key=idempotency_key).first()
+
+
+def place_order(cart, delivery_info, delivery_option, payment_method, user=None, idempotency_key=None):
+    """
+    Turn a cart into an order in one transaction.
+
+    The cart is locked while its items are copied, so two submits of the
+    same cart can't both order it. Submits with an idempotency key that was
+    already used return the order placed by the first one. The number of
+    queries doesn't depend on the number of items.
+    """
+    try:
+        with transaction.atomic():
+            return _place_order(cart, delivery_info, delivery_option, payment_method, user, idempotency_key)
+    except IntegrityError:
+        # A concurrent submit with the same key won the race
+        order = get_placed_order(idempotency_key)
+        if order is None:
+            raise
+        return order
+
+
+def _place_order(cart, delivery_info, delivery_option, payment_method, user, idempotency_key):
+    # Lock the cart first: concurrent checkouts of the same cart queue up here
+    Cart.objects.select_for_update().filter(pk=cart.pk).first()
+
+    order = get_placed_order(idempotency_key)
+    if order is not None:
+        return order
+
+    items = list(
+        CartItem.objects.select_for_update(of=('self',))
+        .select_related('product')
+        .filter(cart_id=cart.pk)
+        .order_by('pk')
+    )
+    if not items:
+        raise EmptyCartError()
+
+    # Totals from the locked rows, not from what the payment page showed
+    summary = CartSummary(cart, items)
+    delivery_cost = delivery_option.price
+
+    order = Order.objects.create(
+        user=user,
+        first_name=delivery_info['first_name'],
+        last_name=delivery_info['last_name'],
+        phone=delivery_info['phone'],
+        email=delivery_info['email'],
+        street_address=delivery_info['street_address'],
+        city=delivery_info['city'],
+        payment_method=payment_method,
+        subtotal=summary.total,  # Already with discounts applied
+        delivery_cost=delivery_cost,
+        discount=summary.total_discount,  # Total savings from discounts
+        total=summary.total + delivery_cost,
+        status='pending',
+        idempotency_key=idempotency_key or None,
+    )
+
+    # Store discounted unit prices, and names in case products get deleted
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=item.product,
+            product_name=item.product.name,
+            product_price=item.get_unit_price(),
+            quantity=item.quantity,
+            subtotal=item.get_subtotal(),
+        )
+        for item in items
+    ])
+
+    delivery = Delivery.objects.create(
+        order=order,
+        delivery_option=delivery_option,
+        status='created',
+    )
+    DeliveryStatusHistory.objects.create(
+        delivery=delivery,
+        status='created',
+        notes='Нарачката е креирана.',
+    )
+
+    # Last, so the product rows are locked for as short as possible
+    reserve_stock(items)
+
+    CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+    return order
+
+
+def reserve_stock(items):
+    """
+    Take the ordered pieces out of stock with one conditional UPDATE.
+
+    Products only lose stock when they have enough of it, so concurrent
+    checkouts can't oversell; when any line falls short nothing is taken
+    and OutOfStockError lists the short lines. Must run in a transaction.
+    """
+    quantities = {item.product_id: item.quantity for item in items}
+    ordered = Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(pk__in=quantities, stock_quantity__gte=ordered).update(
+                stock_quantity=F('stock_quantity') - ordered,
+                availability=Case(When(stock_quantity__gt=ordered, then=Value(True)), default=Value(False)),
+                updated_at=timezone.now(),
+            )
+            if updated != len(quantities):
+                # Undo the lines that did fit before looking at what is left
+                raise OutOfStockError([])
+    except OutOfStockError as error:
+        left = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity'))
+        error.shortages = [
+            (item, left.get(item.product_id, 0))
+            for item in items
+            if left.get(item.product_id, 0) < item.quantity
+        ]
+        raise
+
+    # update() skips the product signals, so invalidate the catalog for sold out products here
+    if Product.objects.filter(pk__in=quantities, availability=False).exists():
+        transaction.on_commit(catalog_changed)
@@ -1,3 +1,164 @@
-from django.test import TestCase
+import threading
+import unittest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from apps.cart.models import Cart, CartItem
+from apps.delivery.models import DeliveryOption
+from apps.products.models import Category, Product
+from .models import Order
+from .services import OutOfStockError, place_order
+from .views import ORDERS_PER_PAGE
 
-# Create your tests here.
+
+DELIVERY_INFO = {
+    'first_name': 'Ана', 'last_name': 'Петрова', 'phone': '070000000', 'email': '',
+    'street_address': 'Партизанска 1', 'city': 'Скопје',
+}
+
+# Templates use {% static %}, which needs a manifest with the production storage
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class CheckoutStockTests(TransactionTestCase):
+    """Checkouts against throwaway products, with real commits between them"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        self.suit = Product.objects.create(
+            name='Oxford', category=category, price=15000, size='50', color='црна',
+            stock_quantity=3, image_path='suits/Oxford.jpg',
+        )
+        self.tie = Product.objects.create(
+            name='Tie', category=category, price=2000, size='универзална', color='црна',
+            stock_quantity=1, image_path='accessories/Tie.jpg',
+        )
+        self.delivery_option = DeliveryOption.objects.create(
+            name='Standard', name_mk='Стандардна', price=200, estimated_days=3,
+        )
+
+    def make_cart(self, *lines):
+        cart = Cart.objects.create(session_key=f'test-{Cart.objects.count()}')
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def checkout(self, cart):
+        return place_order(cart, DELIVERY_INFO, self.delivery_option, 'cash_on_delivery')
+
+    def test_orders_stop_when_stock_runs_out(self):
+        carts = [self.make_cart((self.suit, 1)) for i in range(5)]
+        placed = 0
+        for cart in carts:
+            try:
+                self.checkout(cart)
+                placed += 1
+            except OutOfStockError:
+                pass
+
+        self.suit.refresh_from_db()
+        self.assertEqual(placed, 3)
+        self.assertEqual(self.suit.stock_quantity, 0)
+        self.assertFalse(self.suit.availability)
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        cart = self.make_cart((self.suit, 2), (self.tie, 2))
+
+        with self.assertRaises(OutOfStockError) as raised:
+            self.checkout(cart)
+
+        [(item, left)] = raised.exception.shortages
+        self.assertEqual((item.product_id, left), (self.tie.pk, 1))
+        # The line that did fit gave its pieces back and nothing was ordered
+        self.suit.refresh_from_db()
+        self.tie.refresh_from_db()
+        self.assertEqual(self.suit.stock_quantity, 3)
+        self.assertEqual(self.tie.stock_quantity, 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 2)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'SQLite allows one writer at a time')
+    def test_parallel_checkouts_never_oversell(self):
+        carts = [self.make_cart((self.suit, 1)) for i in range(12)]
+        outcomes = []
+        lock = threading.Lock()
+
+        def worker(cart):
+            try:
+                self.checkout(cart)
+                outcome = 'placed'
+            except OutOfStockError:
+                outcome = 'out_of_stock'
+            finally:
+                connection.close()
+            with lock:
+                outcomes.append(outcome)
+
+        threads = [threading.Thread(target=worker, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.suit.refresh_from_db()
+        self.assertEqual(outcomes.count('placed'), 3)
+        self.assertEqual(outcomes.count('out_of_stock'), 9)
+        self.assertEqual(self.suit.stock_quantity, 0)
+        self.assertEqual(Order.objects.count(), 3)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class OrderPagesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ana')
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {i}', category=category, price=1000, size='50', color='црна',
+                stock_quantity=100, image_path=f'suits/{i}.jpg',
+            )
+            for i in range(3)
+        ]
+        delivery_option = DeliveryOption.objects.create(
+            name='Standard', name_mk='Стандардна', price=200, estimated_days=3,
+        )
+        cls.orders = []
+        for i in range(ORDERS_PER_PAGE + 2):
+            cart = Cart.objects.create(session_key=f'order-{i}')
+            for product in cls.products[:i % 3 + 1]:
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+            cls.orders.append(place_order(cart, DELIVERY_INFO, delivery_option, 'cash_on_delivery', user=cls.user))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_history_is_paginated_newest_first(self):
+        first, first_queries = self.get(reverse('orders:order_history'))
+        last, last_queries = self.get(reverse('orders:order_history'), page=2)
+
+        newest = list(reversed(self.orders))
+        self.assertEqual(list(first.context['orders']), newest[:ORDERS_PER_PAGE])
+        self.assertEqual(list(last.context['orders']), newest[ORDERS_PER_PAGE:])
+        self.assertEqual([order.item_count for order in last.context['orders']], [2, 1])
+        # Ten orders cost as many queries as two
+        self.assertEqual(first_queries, last_queries)
+
+    def test_detail_queries_do_not_grow_with_the_items(self):
+        one_item, three_items = self.orders[0], self.orders[2]
+        counts = [self.get(reverse('orders:order_detail', args=[order.pk]))[1] for order in (one_item, three_items)]
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(three_items.items.count(), 3)
@@ -1,17 +1,21 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.utils import timezone
-from apps.cart.views import get_or_create_cart
-from apps.delivery.models import DeliveryOption, Delivery, DeliveryStatusHistory
-from .models import Order, OrderItem
+from django.core.paginator import Paginator
+from django.db.models import Count
+import uuid
+from apps.cart.views import get_cart_summary
+from apps.delivery.models import DeliveryOption
+from .models import Order
+from .services import EmptyCartError, OutOfStockError, get_placed_order, place_order
 
 
 def checkout_delivery(request):
     """Delivery information step"""
-    cart = get_or_create_cart(request)
+    summary = get_cart_summary(request)
+    cart = summary.cart
     
-    if not cart.items.exists():
+    if summary.is_empty:
         messages.warning(request, 'Вашата кошничка е празна.')
         return redirect('cart:cart_detail')
     
@@ -33,20 +37,29 @@ def checkout_delivery(request):
     
     context = {
         'cart': cart,
+        'cart_items': summary.items,
         'delivery_options': delivery_options,
-        'subtotal': cart.get_total(),
-        'original_subtotal': cart.get_original_total(),
-        'total_discount': cart.get_total_discount(),
-        'has_discounts': cart.has_discounts(),
+        'subtotal': summary.total,
+        'original_subtotal': summary.original_total,
+        'total_discount': summary.total_discount,
+        'has_discounts': summary.has_discounts,
     }
     return render(request, 'checkout/delivery.html', context)
 
 
 def checkout_payment(request):
     """Payment method step"""
-    cart = get_or_create_cart(request)
+    # A resubmitted form (double click, retry) goes to the order it already placed
+    checkout_token = request.POST.get('checkout_token', '')[:64]
+    if request.method == 'POST':
+        order = get_placed_order(checkout_token)
+        if order is not None:
+            return redirect('orders:order_confirmation', order_id=order.id)
+    
+    summary = get_cart_summary(request)
+    cart = summary.cart
     
-    if not cart.items.exists():
+    if summary.is_empty:
         messages.warning(request, 'Вашата кошничка е празна.')
         return redirect('cart:cart_detail')
     
@@ -59,57 +72,25 @@ def checkout_payment(request):
     delivery_option = get_object_or_404(DeliveryOption, pk=delivery_info['delivery_option_id'])
     
     if request.method == 'POST':
-        payment_method = request.POST.get('payment_method')
-        
-        # Create order with discount information
-        subtotal = cart.get_total()  # This is already with discounts applied
-        total_discount = cart.get_total_discount()  # Total savings from discounts
-        delivery_cost = delivery_option.price
-        total = subtotal + delivery_cost
-        
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            first_name=delivery_info['first_name'],
-            last_name=delivery_info['last_name'],
-            phone=delivery_info['phone'],
-            email=delivery_info['email'],
-            street_address=delivery_info['street_address'],
-            city=delivery_info['city'],
-            payment_method=payment_method,
-            subtotal=subtotal,
-            delivery_cost=delivery_cost,
-            discount=total_discount,  # Store the total discount amount
-            total=total,
-            status='pending',
-        )
-        
-        # Create order items (store discounted prices if applicable)
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                product_name=item.product.name,
-                product_price=item.get_unit_price(),  # Store discounted unit price
-                quantity=item.quantity,
-                subtotal=item.get_subtotal(),
+        try:
+            order = place_order(
+                cart,
+                delivery_info,
+                delivery_option,
+                payment_method=request.POST.get('payment_method'),
+                user=request.user if request.user.is_authenticated else None,
+                idempotency_key=checkout_token,
             )
-        
-        # Create delivery record
-        delivery = Delivery.objects.create(
-            order=order,
-            delivery_option=delivery_option,
-            status='created',
-        )
-        
-        # Create initial delivery status history
-        DeliveryStatusHistory.objects.create(
-            delivery=delivery,
-            status='created',
-            notes='Нарачката е креирана.',
-        )
-        
-        # Clear cart
-        cart.items.all().delete()
+        except EmptyCartError:
+            messages.warning(request, 'Вашата кошничка е празна.')
+            return redirect('cart:cart_detail')
+        except OutOfStockError as error:
+            for item, left in error.shortages:
+                if left:
+                    messages.error(request, f'{item.product.name}: на залиха има само {left} парчиња.')
+                else:
+                    messages.error(request, f'{item.product.name} повеќе не е достапен.')
+            return redirect('cart:cart_detail')
         
         # Clear session
         if 'delivery_info' in request.session:
@@ -117,10 +98,10 @@ def checkout_payment(request):
         
         return redirect('orders:order_confirmation', order_id=order.id)
     
-    subtotal = cart.get_total()
-    original_subtotal = cart.get_original_total()
-    total_discount = cart.get_total_discount()
-    has_discounts = cart.has_discounts()
+    subtotal = summary.total
+    original_subtotal = summary.original_total
+    total_discount = summary.total_discount
+    has_discounts = summary.has_discounts
     delivery_cost = delivery_option.price
     total = subtotal + delivery_cost
     
@@ -134,13 +115,20 @@ def checkout_payment(request):
         'has_discounts': has_discounts,
         'delivery_cost': delivery_cost,
         'total': total,
+        'checkout_token': uuid.uuid4().hex,
     }
     return render(request, 'checkout/payment.html', context)
 
 
+def get_order_with_items(order_id):
+    """Order with its delivery, items and their products in three queries"""
+    orders = Order.objects.select_related('delivery').prefetch_related('items__product')
+    return get_object_or_404(orders, pk=order_id)
+
+
 def order_confirmation(request, order_id):
     """Order confirmation page"""
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_order_with_items(order_id)
     
     # Security: ensure user can only see their own order
     if request.user.is_authenticated and order.user != request.user:
@@ -154,13 +142,22 @@ def order_confirmation(request, order_id):
     return render(request, 'checkout/confirmation.html', context)
 
 
+ORDERS_PER_PAGE = 10
+
+
 @login_required
 def order_history(request):
     """View user's order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = (
+        Order.objects.filter(user=request.user)
+        .annotate(item_count=Count('items'))
+        .order_by('-created_at', '-id')
+    )
+    page_obj = Paginator(orders, ORDERS_PER_PAGE).get_page(request.GET.get('page'))
     
     context = {
-        'orders': orders,
+        'orders': page_obj.object_list,
+        'page_obj': page_obj,
     }
     return render(request, 'orders/order_history.html', context)
 
@@ -168,7 +165,7 @@ def order_history(request):
 @login_required
 def order_detail(request, order_id):
     """View order details"""
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_order_with_items(order_id)
     
     # Security check
     if order.user != request.user and not request.user.is_staff:
@@ -4,24 +4,26 @@ from .models import Category, Product
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'name_mk', 'slug']
+    list_display = ['name', 'name_mk', 'slug', 'sort_rank']
+    list_editable = ['sort_rank']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'name_mk']
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'size', 'color', 'availability', 'is_featured', 'is_new', 'is_popular']
+    list_display = ['name', 'category', 'price', 'size', 'color', 'stock_quantity', 'availability', 'is_featured', 'is_new', 'is_popular']
     list_filter = ['category', 'availability', 'is_featured', 'is_new', 'is_popular', 'size', 'color']
     search_fields = ['name', 'description']
-    list_editable = ['availability', 'is_featured', 'is_new', 'is_popular']
+    list_editable = ['stock_quantity', 'is_featured', 'is_new', 'is_popular']
     list_per_page = 50
+    readonly_fields = ['availability']
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'category', 'description', 'price')
         }),
         ('Product Details', {
-            'fields': ('size', 'color', 'availability', 'image_path')
+            'fields': ('size', 'color', 'stock_quantity', 'availability', 'image_path')
         }),
         ('Display Options', {
             'fields': ('is_featured', 'is_new', 'is_popular')
@@ -0,0 +1,70 @@
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+# The catalog version lives in a single database row, so a bump by any
+# process (another worker, a management command) reaches every worker
+CATALOG_VERSION_ID = 1
+
+# (version, modified, monotonic time it was read) as last seen by this process
+_seen = None
+
+
+def read_catalog_version():
+    """(version, modified) from the database, creating the row on first use"""
+    from .models import CatalogVersion
+    versions = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', 'modified')
+    row = versions.first()
+    if row is None:
+        # Start from the clock so a recreated row never reuses an old version
+        CatalogVersion.objects.get_or_create(
+            pk=CATALOG_VERSION_ID, defaults={'version': time.time_ns(), 'modified': timezone.now()},
+        )
+        row = versions.get()
+    return row
+
+
+def get_catalog_state():
+    """
+    (version, modified) of the catalog as this process knows it.
+
+    The database is asked at most once every CATALOG_VERSION_CHECK_INTERVAL
+    seconds, so changes made elsewhere show up within that time.
+    """
+    global _seen
+    seen = _seen
+    if seen is None or time.monotonic() - seen[2] >= settings.CATALOG_VERSION_CHECK_INTERVAL:
+        checked_at = time.monotonic()
+        version, modified = read_catalog_version()
+        seen = _seen = (version, modified, checked_at)
+    return seen[0], seen[1]
+
+
+def get_catalog_version():
+    """Current catalog version, used to version cached catalog data"""
+    return get_catalog_state()[0]
+
+
+def get_catalog_modified():
+    """When the catalog last changed, for Last-Modified headers"""
+    return get_catalog_state()[1]
+
+
+def bump_catalog_version():
+    """Invalidate cached catalog data in every process by moving to a new version"""
+    global _seen
+    from .models import CatalogVersion
+    now = timezone.now()
+    versions = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID)
+    with transaction.atomic():
+        # The UPDATE locks the row until commit, so the version read back is ours
+        if not versions.update(version=F('version') + 1, modified=now):
+            read_catalog_version()
+            versions.update(version=F('version') + 1, modified=now)
+        version = versions.values_list('version', flat=True).get()
+    # This process sees its own change right away
+    _seen = (version, now, time.monotonic())
+    return version
@@ -0,0 +1,133 @@
+"""
+Read-only catalog snapshot held by each worker.
+
+Pages read categories and available products from compact __slots__
+records instead of building model instances on every request. A snapshot
+is never modified: when the catalog version moves, whichever process made
+the change, the next request builds a new one from two queries and swaps
+it in with a single assignment, so requests in flight keep reading the one
+they started with.
+"""
+from types import MappingProxyType
+from .cache import get_catalog_version
+from .images import original_url
+from .models import Category, Product
+
+
+# Products per home page section
+HOME_SECTION_SIZE = 6
+
+
+class Record:
+    """Base of the snapshot records: fields set once, in __slots__ order"""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} records are read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} records are read-only')
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class CategoryRecord(Record):
+    __slots__ = ('id', 'name', 'name_mk', 'slug', 'sort_rank')
+
+    def __str__(self):
+        return self.name_mk
+
+
+class ProductRecord(Record):
+    """An available product, with the fields the catalog pages show"""
+    __slots__ = (
+        'id', 'name', 'category', 'description', 'price', 'size', 'color', 'image_path',
+        'is_featured', 'is_new', 'is_popular', 'created_at', 'updated_at',
+    )
+
+    # Only available products are in the snapshot
+    availability = True
+
+    @property
+    def category_id(self):
+        return self.category.id
+
+    def __str__(self):
+        return f"{self.name} ({self.category.name})"
+
+    def get_image_url(self):
+        return original_url(self.image_path)
+
+
+PRODUCT_FIELDS = (
+    'id', 'name', 'category_id', 'description', 'price', 'size', 'color', 'image_path',
+    'is_featured', 'is_new', 'is_popular', 'created_at', 'updated_at',
+)
+
+
+class CatalogSnapshot:
+    """Categories and available products of one catalog version"""
+    __slots__ = ('version', 'categories', 'products', 'by_category', 'home_sections')
+
+    def __init__(self, version, categories, products):
+        self.version = version
+        self.categories = tuple(categories)          # in Category Meta ordering
+        self.products = MappingProxyType(products)   # id -> record, newest first
+
+        by_category = {}
+        for product in products.values():
+            by_category.setdefault(product.category.id, []).append(product)
+        self.by_category = MappingProxyType({key: tuple(value) for key, value in by_category.items()})
+
+        # Accessories are left out of the home page
+        shown = [product for product in products.values() if product.category.name != 'Accessory']
+        self.home_sections = MappingProxyType({
+            'featured_products': tuple(p for p in shown if p.is_featured)[:HOME_SECTION_SIZE],
+            'new_products': tuple(p for p in shown if p.is_new)[:HOME_SECTION_SIZE],
+            'popular_products': tuple(p for p in shown if p.is_popular)[:HOME_SECTION_SIZE],
+            'categories': self.categories,
+        })
+
+    @classmethod
+    def build(cls, version):
+        categories = {
+            row[0]: CategoryRecord(*row)
+            for row in Category.objects.values_list('id', 'name', 'name_mk', 'slug', 'sort_rank')
+        }
+        products = {
+            row[0]: ProductRecord(row[0], row[1], categories[row[2]], *row[3:])
+            for row in Product.objects.filter(availability=True).values_list(*PRODUCT_FIELDS)
+        }
+        return cls(version, categories.values(), products)
+
+    def get(self, product_id):
+        return self.products.get(product_id)
+
+    def hydrate(self, product_ids):
+        """Records of the given products in the given order, skipping unavailable ones"""
+        products = self.products
+        return [products[product_id] for product_id in product_ids if product_id in products]
+
+    def related(self, product):
+        """Other available products of the product's category, newest first"""
+        return [other for other in self.by_category.get(product.category.id, ()) if other.id != product.id]
+
+
+_snapshot = None
+
+
+def get_catalog_snapshot():
+    """This worker's snapshot of the current catalog version"""
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        snapshot = CatalogSnapshot.build(version)
+        _snapshot = snapshot
+    return snapshot
@@ -0,0 +1,10 @@
+from .decorators import CSRF_TOKEN_PLACEHOLDER
+
+
+def page_cache(request):
+    """Keep the visitor's CSRF token out of pages rendered for the page cache"""
+    if getattr(request, '_page_cache', False):
+        return {
+            'csrf_token': CSRF_TOKEN_PLACEHOLDER
+        }
+    return {}
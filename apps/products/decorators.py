@@ -0,0 +1,190 @@
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .cache import get_catalog_version, get_catalog_modified
+from .catalog import get_catalog_snapshot
+from .similarity import get_similarity_index
+
+
+PAGE_CACHE_KEY = 'products:page:{}'
+
+# Rendered into cached pages instead of the visitor's CSRF token. Visitors
+# with a session get a fresh token swapped in on the way out; pages shared
+# through CDNs keep the placeholder and get the token from cart/count/ in JS
+CSRF_TOKEN_PLACEHOLDER = '__page_cache_csrf_token__'
+
+
+def is_shared_visitor(request):
+    """Anonymous visitor without a session, who sees the same page as everyone else"""
+    return not request.user.is_authenticated and not request.session.session_key
+
+
+def visitor_state(request):
+    """
+    The parts of a catalog page that depend on the visitor, or None if the
+    page can't be validated or cached at all.
+
+    Pages show the user menu, a CSRF token tied to the CSRF cookie and, for
+    signed in users, the cart badge (anonymous visitors get theirs filled in
+    client-side). Once in a while they show a flash message.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    if not request.user.is_authenticated:
+        return f':{csrf_cookie}'
+
+    from apps.cart.context_processors import get_cart_item_count
+    return f'{request.user.pk}:{get_cart_item_count(request)}:{csrf_cookie}'
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def page_cache_key(request):
+    """Cache key of a page, the same for any order of its query parameters"""
+    query = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    return PAGE_CACHE_KEY.format(make_etag(request.path, query))
+
+
+def catalog_page_version(request, *args, **kwargs):
+    """Version of the cached copies of pages built from the whole catalog"""
+    return get_catalog_version()
+
+
+def catalog_validator(request, *args, **kwargs):
+    """Validator of pages built from the whole catalog"""
+    return get_catalog_version()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return get_catalog_modified()
+
+
+def get_detail_product(request, pk):
+    """Product shown on the detail page, looked up once per request"""
+    if not hasattr(request, '_detail_product'):
+        request._detail_product = get_catalog_snapshot().get(pk)
+    return request._detail_product
+
+
+def product_page_version(request, pk):
+    """
+    Version of the cached copies of product detail pages.
+
+    Related products are ranked by picture similarity, so the pages also
+    change when build_image_features writes new feature vectors.
+    """
+    return f'{get_catalog_version()}:{get_similarity_index().version}'
+
+
+def product_validator(request, pk):
+    """
+    Validator of a product detail page.
+
+    Besides the product itself the page lists related products, so the
+    catalog version and the picture features are part of it too.
+    """
+    product = get_detail_product(request, pk)
+    if product is None:
+        return None
+    return f'{product.pk}:{product.updated_at.timestamp()}:{product_page_version(request, pk)}'
+
+
+def product_last_modified(request, pk):
+    product = get_detail_product(request, pk)
+    if product is None:
+        return None
+    # The features are missing until build_image_features has run
+    return max(filter(None, (product.updated_at, get_catalog_modified(), get_similarity_index().modified)))
+
+
+def catalog_page(validator=catalog_validator, last_modified_func=catalog_last_modified, page_version=catalog_page_version):
+    """
+    Serve a catalog page from the page cache, answer conditional GETs with
+    304 Not Modified and set caching headers.
+
+    Pages for anonymous visitors are cached by URL and query for the current
+    catalog version, so repeat traffic renders nothing and, for visitors
+    without a session, only reads the shared catalog version now and then.
+
+    Pages of visitors without a session may be kept by shared caches for
+    CATALOG_PAGE_MAX_AGE seconds; everything else is private and always
+    revalidated by the browser.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            state = visitor_state(request)
+            cache_key = None
+            entry = None
+            if state is not None and not request.user.is_authenticated:
+                cache_key = page_cache_key(request)
+                version = page_version(request, *args, **kwargs)
+                entry = cache.get(cache_key, version=version)
+
+            if entry is not None:
+                page_validator, last_modified = entry['validator'], entry['last_modified']
+            else:
+                page_validator = validator(request, *args, **kwargs)
+                last_modified = last_modified_func(request, *args, **kwargs)
+
+            etag = None
+            if state is not None and page_validator is not None:
+                etag = quote_etag(make_etag(page_validator, state))
+            # A date can't tell visitors apart, so only pages everyone shares get one
+            if not is_shared_visitor(request):
+                last_modified = None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                if entry is not None:
+                    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+                else:
+                    request._page_cache = cache_key is not None
+                    response = view_func(request, *args, **kwargs)
+                    if cache_key is not None and response.status_code == 200 and not response.cookies:
+                        cache.set(cache_key, {
+                            'content': response.content,
+                            'content_type': response['Content-Type'],
+                            'validator': page_validator,
+                            'last_modified': last_modified_func(request, *args, **kwargs),
+                        }, settings.CATALOG_PAGE_CACHE_TIMEOUT, version=version)
+
+                # get_token() makes the CSRF middleware set a cookie, which
+                # would keep the page out of shared caches
+                placeholder = CSRF_TOKEN_PLACEHOLDER.encode()
+                if cache_key is not None and not is_shared_visitor(request) and placeholder in response.content:
+                    response.content = response.content.replace(placeholder, get_token(request).encode())
+
+                if response.status_code == 200:
+                    if etag:
+                        response.headers.setdefault('ETag', etag)
+                    if timestamp:
+                        response.headers.setdefault('Last-Modified', http_date(timestamp))
+
+            if response.status_code not in (200, 304):
+                return response
+
+            # Responses that set cookies are never shared; the CSRF cookie is
+            # only added by the middleware after the view has returned
+            sets_cookies = response.cookies or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            if is_shared_visitor(request) and not sets_cookies:
+                patch_cache_control(response, public=True, max_age=0, s_maxage=settings.CATALOG_PAGE_MAX_AGE)
+            else:
+                patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
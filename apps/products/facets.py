@@ -0,0 +1,408 @@
+import base64
+import copy
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from .cache import get_catalog_version
+from .models import Product, Category
+
+
+# Sizes are shown in this order in the filters
+SIZE_ORDER = ['XS', 'S', 'M', 'L', 'XL', 'XXL', '36', '38', '40', '42', '44', '46', '48', '50', '52', '54', '56', 'универзална']
+
+# (key, label, lower bound, upper bound) - upper bound is exclusive
+PRICE_BUCKETS = [
+    ('0-5000', 'До 5.000 ден.', Decimal('0'), Decimal('5000')),
+    ('5000-10000', '5.000 - 10.000 ден.', Decimal('5000'), Decimal('10000')),
+    ('10000-20000', '10.000 - 20.000 ден.', Decimal('10000'), Decimal('20000')),
+    ('20000-30000', '20.000 - 30.000 ден.', Decimal('20000'), Decimal('30000')),
+    ('30000+', 'Над 30.000 ден.', Decimal('30000'), None),
+]
+
+FACETS = ('category', 'size', 'color', 'price')
+
+SORT_CHOICES = [
+    ('', 'Препорачано'),
+    ('price_asc', 'Цена: најниска прво'),
+    ('price_desc', 'Цена: највисока прво'),
+]
+
+
+def price_bucket(price):
+    for key, label, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def parse_price(value):
+    """Parse a price filter value, ignoring anything that is not a number"""
+    if not value:
+        return None
+    try:
+        return Decimal(str(value).strip().replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+def listing_key(sort_rank, created_at, product_id):
+    """Sort key of the default listing order: category rank, then newest first"""
+    created_us = round(created_at.timestamp() * 1_000_000)
+    return (sort_rank, -created_us, -product_id)
+
+
+def encode_cursor(sort, key):
+    """Opaque token for the position after which the next page starts"""
+    if isinstance(key, tuple) and isinstance(key[0], Decimal):
+        key = (str(key[0]), key[1])
+    data = json.dumps({'s': sort, 'k': key}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """Key encoded in a cursor token, or None for the first page"""
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if data['s'] != sort:
+            return None
+        key = data['k']
+        if isinstance(key, int):
+            return key
+        if sort:
+            price = Decimal(key[0])
+            # NaN can't be compared with the prices in the index
+            return (price, int(key[1])) if price.is_finite() else None
+        return tuple(int(value) for value in key)
+    except (ValueError, TypeError, KeyError, IndexError, InvalidOperation):
+        return None
+
+
+def mask_from_positions(positions, size):
+    """Build a bitset with the given bit positions set"""
+    buf = bytearray((size + 7) // 8)
+    for position in positions:
+        buf[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def iter_positions(mask):
+    """Yield the set bit positions of a bitset in ascending order"""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (byte_index << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+class FacetIndex:
+    """
+    Bitset index over available products for the product listing.
+
+    Every product gets a bit position in listing order (category rank,
+    newest first), and every facet value holds the bitset of the products
+    that have it. Any filter combination is a few integer ANDs and facet
+    counts are popcounts. Price orders are kept as position lists sorted by
+    (price, id) so pages can be resumed from a key with a bisect.
+    """
+
+    def __init__(self, version, categories):
+        self.version = version
+        self.categories = categories  # list of (slug, name_mk) for the filter
+        self.ids = []                 # bit position -> product id
+        self.positions = {}           # product id -> bit position
+        self.prices = []              # bit position -> price
+        self.listing_keys = []        # bit position -> listing sort key
+        self.values = {}              # product id -> facet values
+        self.facets = {name: {} for name in FACETS}
+        self.all = 0
+        self._price_order = None
+
+    @classmethod
+    def build(cls, version):
+        categories = {c.id: c for c in Category.objects.all()}
+        index = cls(version, [(c.slug, c.name_mk) for c in categories.values()])
+
+        # Read in listing order from the (availability, sort_rank, created_at) index;
+        # the sort only breaks created_at ties by id and is linear on sorted input
+        rows = sorted(
+            (listing_key(sort_rank, created_at, product_id), product_id, category_id, size, color, price)
+            for product_id, category_id, size, color, price, sort_rank, created_at in (
+                Product.objects.filter(availability=True)
+                .order_by('sort_rank', '-created_at')
+                .values_list('id', 'category_id', 'size', 'color', 'price', 'sort_rank', 'created_at')
+            )
+        )
+
+        positions_by_value = {name: {} for name in FACETS}
+        for position, (key, product_id, category_id, size, color, price) in enumerate(rows):
+            values = (categories[category_id].slug, size, color, price_bucket(price))
+            index.ids.append(product_id)
+            index.positions[product_id] = position
+            index.prices.append(price)
+            index.listing_keys.append(key)
+            index.values[product_id] = values
+            for name, value in zip(FACETS, values):
+                positions_by_value[name].setdefault(value, []).append(position)
+
+        size = len(rows)
+        for name, by_value in positions_by_value.items():
+            for value, positions in by_value.items():
+                index.facets[name][value] = mask_from_positions(positions, size)
+        index.all = mask_from_positions(range(size), size)
+        return index
+
+    def update_product(self, product):
+        """
+        Apply a saved product in place.
+
+        Returns False when the change moves the product in the listing order
+        (new product, category change) and the index has to be rebuilt.
+        """
+        position = self.positions.get(product.pk)
+        if position is None:
+            return not product.availability
+
+        old_values = self.values[product.pk]
+        values = (product.category.slug, product.size, product.color, price_bucket(product.price))
+        if values[0] != old_values[0]:
+            return False
+
+        bit = 1 << position
+        for name, old, new in zip(FACETS, old_values, values):
+            if old != new:
+                self.facets[name][old] &= ~bit
+                self.facets[name][new] = self.facets[name].get(new, 0) | bit
+        self.values[product.pk] = values
+        if self.prices[position] != product.price:
+            self.prices[position] = product.price
+            self._price_order = None
+
+        if product.availability:
+            self.all |= bit
+        else:
+            self.all &= ~bit
+        return True
+
+    def copy(self):
+        """Copy that can be patched while requests keep reading this one"""
+        index = copy.copy(self)
+        index.facets = {name: dict(masks) for name, masks in self.facets.items()}
+        index.values = dict(self.values)
+        index.prices = list(self.prices)
+        return index
+
+    def remove_product(self, product_id):
+        position = self.positions.get(product_id)
+        if position is not None:
+            self.all &= ~(1 << position)
+
+    def price_order(self):
+        """Bit positions sorted by (price, id) and their sort keys"""
+        if self._price_order is None:
+            order = sorted(range(len(self.ids)), key=lambda p: (self.prices[p], self.ids[p]))
+            self._price_order = (order, [(self.prices[p], self.ids[p]) for p in order])
+        return self._price_order
+
+    def ids_to_mask(self, product_ids):
+        positions = [self.positions[i] for i in product_ids if i in self.positions]
+        return mask_from_positions(positions, len(self.ids))
+
+    def price_range_mask(self, mask, min_price=None, max_price=None):
+        """Narrow a bitset to products within an arbitrary price range"""
+        positions = [
+            position for position in iter_positions(mask)
+            if (min_price is None or self.prices[position] >= min_price)
+            and (max_price is None or self.prices[position] <= max_price)
+        ]
+        return mask_from_positions(positions, len(self.ids))
+
+    def search(self, filters, restrict=None, ranking=None, sort=''):
+        """
+        Apply facet filters ({facet: value}) and return (result, counts).
+
+        Results come in listing order, in price order for a price ``sort``,
+        or else in the order of ``ranking`` product ids (search relevance)
+        when one is given.
+
+        Counts for each facet are computed with every other facet's filter
+        applied, so they show how many products selecting a value would give.
+        """
+        base = self.all if restrict is None else self.all & restrict
+        selected = {
+            name: self.facets[name].get(value, 0)
+            for name, value in filters.items() if value
+        }
+
+        result = base
+        for mask in selected.values():
+            result &= mask
+
+        counts = {}
+        for name in FACETS:
+            others = base
+            for other, mask in selected.items():
+                if other != name:
+                    others &= mask
+            counts[name] = {
+                value: (bits & others).bit_count()
+                for value, bits in self.facets[name].items()
+            }
+        return FacetResult(self, result, ranking, sort), counts
+
+
+class FacetResult:
+    """Ordered search result that loads products only for the requested slice"""
+
+    def __init__(self, index, mask, ranking=None, sort=''):
+        self.index = index
+        self.mask = mask
+        self.ranking = ranking if not sort else None
+        self.sort = sort
+
+    def count(self):
+        return self.mask.bit_count()
+
+    def __len__(self):
+        return self.count()
+
+    def _matches_after(self, key=None):
+        """Yield (product id, cursor key) of matches that sort after the key"""
+        index = self.index
+        mask = self.mask
+
+        if self.ranking is not None:
+            start = key if isinstance(key, int) else 0
+            for offset, product_id in enumerate(self.ranking[start:], start + 1):
+                position = index.positions.get(product_id)
+                if position is not None and mask >> position & 1:
+                    yield product_id, offset
+            return
+
+        if self.sort:
+            order, keys = index.price_order()
+            if not isinstance(key, tuple):
+                key = None
+            if self.sort == 'price_asc':
+                start = bisect_right(keys, key) if key is not None else 0
+                steps = range(start, len(order))
+            else:
+                end = bisect_left(keys, key) if key is not None else len(order)
+                steps = range(end - 1, -1, -1)
+            for i in steps:
+                if mask >> order[i] & 1:
+                    yield index.ids[order[i]], keys[i]
+            return
+
+        start = bisect_right(index.listing_keys, key) if isinstance(key, tuple) else 0
+        for position in iter_positions(mask >> start):
+            position += start
+            yield index.ids[position], index.listing_keys[position]
+
+    def _matches_upto(self, key):
+        """Yield (product id, cursor key) of matches up to and including the key, backwards"""
+        index = self.index
+        mask = self.mask
+
+        if self.ranking is not None:
+            end = min(key, len(self.ranking)) if isinstance(key, int) else 0
+            for offset in range(end, 0, -1):
+                position = index.positions.get(self.ranking[offset - 1])
+                if position is not None and mask >> position & 1:
+                    yield self.ranking[offset - 1], offset
+            return
+
+        if self.sort:
+            order, keys = index.price_order()
+            if not isinstance(key, tuple):
+                return
+            if self.sort == 'price_asc':
+                steps = range(bisect_right(keys, key) - 1, -1, -1)
+            else:
+                steps = range(bisect_left(keys, key), len(order))
+            for i in steps:
+                if mask >> order[i] & 1:
+                    yield index.ids[order[i]], keys[i]
+            return
+
+        if not isinstance(key, tuple):
+            return
+        for position in range(bisect_right(index.listing_keys, key) - 1, -1, -1):
+            if mask >> position & 1:
+                yield index.ids[position], index.listing_keys[position]
+
+    def product_ids(self, start=0, stop=None):
+        return [product_id for product_id, key in islice(self._matches_after(), start, stop)]
+
+    def page_after(self, key, size):
+        """
+        Keyset pagination: return the products after the cursor key and
+        the key to continue from, or None on the last page.
+        """
+        matches = list(islice(self._matches_after(key), size + 1))
+        next_key = matches[size - 1][1] if len(matches) > size else None
+        return hydrate([product_id for product_id, key in matches[:size]]), next_key
+
+    def previous_key(self, key, size):
+        """
+        Cursor key of the page before the one after the key, or None when
+        that is the first page.
+        """
+        matches = list(islice(self._matches_upto(key), size + 1))
+        return matches[size][1] if len(matches) > size else None
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        return hydrate(self.product_ids(key.start or 0, key.stop))
+
+
+def hydrate(ids):
+    """Products in the given id order, from the catalog snapshot"""
+    from .catalog import get_catalog_snapshot
+    return get_catalog_snapshot().hydrate(ids)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_facet_index():
+    """Return the facet index for the current catalog version"""
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != version:
+                index = _index = FacetIndex.build(version)
+    return index
+
+
+def apply_product_change(version, saved=None, deleted_id=None):
+    """
+    Patch this worker's index after a committed product change.
+
+    The patch is only taken over when no other change happened since the
+    index was built, in this process or any other; otherwise the next
+    request rebuilds it. A patched copy replaces the index, so requests
+    reading the current one never see it half updated.
+    """
+    global _index
+    with _index_lock:
+        index = _index
+        if index is None or index.version + 1 != version:
+            return
+        patched = index.copy()
+        if deleted_id is not None:
+            patched.remove_product(deleted_id)
+        elif not patched.update_product(saved):
+            _index = None
+            return
+        patched.version = version
+        _index = patched
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.encoding import filepath_to_uri, iri_to_uri
+from django.utils.text import slugify
+
+
+# Widths of the generated derivatives, in pixels
+DERIVATIVE_WIDTHS = (160, 320, 640, 960)
+
+# Product pictures and their derivatives are served as static files under these prefixes
+PICTURES_PREFIX = 'products'
+DERIVATIVES_PREFIX = 'derivatives'
+
+MANIFEST_NAME = 'manifest.json'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def manifest_path():
+    return os.path.join(settings.IMAGE_DERIVATIVES_ROOT, MANIFEST_NAME)
+
+
+def read_manifest():
+    """Derivative manifest: source path -> hash, stat and variants"""
+    try:
+        with open(manifest_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest):
+    path = manifest_path()
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def find_images(pictures_dir):
+    """Map image paths relative to the pictures folder to absolute paths"""
+    sources = {}
+    for root, dirs, files in os.walk(pictures_dir):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                source = os.path.join(root, name)
+                image_path = os.path.relpath(source, pictures_dir).replace(os.sep, '/')
+                sources[image_path] = source
+    return sources
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generate_derivatives(source, image_path, output_dir, widths=DERIVATIVE_WIDTHS):
+    """
+    Write WebP and JPEG derivatives of one source image.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    Derivative names contain the source content hash, so changed images
+    get new URLs and old ones can be cached forever.
+    """
+    from PIL import Image, ImageOps
+
+    digest = file_digest(source)
+    stem = slugify(os.path.splitext(os.path.basename(image_path))[0]) or 'image'
+
+    with Image.open(source) as original:
+        # Let the JPEG decoder skip detail we are going to throw away anyway
+        original.draft('RGB', (max(widths), 1))
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    full_width, full_height = image.size
+
+    # Never upscale: widths above the original collapse to the original width
+    targets = sorted({min(width, full_width) for width in widths}, reverse=True)
+
+    variants = []
+    for width in targets:
+        # Each size is resized from the previous, larger one
+        height = round(full_height * width / full_width)
+        if width != image.width:
+            image = image.resize((width, height), Image.LANCZOS)
+        base_name = f'{stem}-{digest[:10]}-{width}w'
+        image.save(os.path.join(output_dir, f'{base_name}.webp'), 'WEBP', quality=80)
+        image.save(os.path.join(output_dir, f'{base_name}.jpg'), 'JPEG', quality=82, optimize=True, progressive=True)
+        variants.insert(0, {
+            'width': width,
+            'height': height,
+            'webp': f'{base_name}.webp',
+            'jpeg': f'{base_name}.jpg',
+        })
+
+    return {
+        'hash': digest,
+        'width': full_width,
+        'height': full_height,
+        'variants': variants,
+    }
+
+
+_manifest = None
+
+
+def get_image_variants(image_path):
+    """Manifest entry for a product image, or None if it has no derivatives"""
+    global _manifest
+    if _manifest is None:
+        _manifest = read_manifest()
+    return _manifest.get(image_path)
+
+
+@lru_cache(maxsize=None)
+def static_url(name):
+    """
+    Fingerprinted URL of a static file, resolved once per process.
+
+    Falls back to the plain URL for files missing from the staticfiles
+    manifest (e.g. pictures added after the last collectstatic).
+    """
+    try:
+        # Manifest storages return the URL unquoted; spaces would break srcset
+        return iri_to_uri(static(name))
+    except ValueError:
+        return settings.STATIC_URL + filepath_to_uri(name)
+
+
+def original_url(image_path):
+    """URL of the original product picture"""
+    return static_url(f'{PICTURES_PREFIX}/{image_path}')
+
+
+def derivative_url(name):
+    return static_url(f'{DERIVATIVES_PREFIX}/{name}')
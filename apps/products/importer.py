@@ -0,0 +1,321 @@
+"""
+Bulk import of product feeds.
+
+Rows are streamed from CSV or JSON Lines files, validated one by one and
+upserted in batches keyed on (name, category): each batch is one short
+transaction with one query to read the products it touches and one
+INSERT ... ON CONFLICT DO UPDATE for the rows that add or change
+something. Rows that match the stored product are skipped, so refreshing
+an unchanged feed only reads.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .models import Category, Product, catalog_changed
+from .search import build_search_text, index_products, rebuild_search_index
+
+
+BATCH_SIZE = 1000
+
+# Fields a feed row can set; missing ones keep the stored value (or the
+# model default for new products)
+FEED_FIELDS = (
+    'description', 'price', 'size', 'color', 'stock_quantity', 'image_path',
+    'is_featured', 'is_new', 'is_popular',
+)
+# New products need these; there is no sensible default for the stock
+REQUIRED_FIELDS = ('price', 'size', 'color', 'stock_quantity')
+
+# Computed from the feed fields, like Product.save() does
+DERIVED_FIELDS = ('availability', 'search_text', 'sort_rank', 'updated_at')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'да'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'не'}
+
+# Messages kept per run for invalid rows
+ERROR_LIMIT = 50
+
+FEED_FORMATS = ('csv', 'jsonl')
+
+
+class RowError(ValueError):
+    """A feed row that can't be imported"""
+
+
+class ImportStats:
+    """Counters of one import run"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.errors = []  # (line, message), the first ERROR_LIMIT of them
+
+    def error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < ERROR_LIMIT:
+            self.errors.append((line, message))
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return (
+            f'{self.rows} rows: {self.created} new, {self.updated} changed, {self.unchanged} unchanged, '
+            f'{self.invalid} invalid in {self.seconds:.1f}s ({self.rate:.0f} rows/s)'
+        )
+
+
+def feed_format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_feed(path, format=None):
+    """Yield (line number, row dict) of a feed file; rows that aren't JSON objects come as None"""
+    format = format or feed_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else None
+
+
+def choice_lookup(choices):
+    """Accept choice values and labels in any case"""
+    lookup = {}
+    for value, label in choices:
+        lookup[value.lower()] = value
+        lookup[label.lower()] = value
+    return lookup
+
+
+SIZES = choice_lookup(Product.SIZE_CHOICES)
+COLORS = choice_lookup(Product.COLOR_CHOICES)
+
+
+def parse_text(value, max_length=None):
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise RowError(f'longer than {max_length} characters')
+    return value
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value).strip().replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f'{value!r} is not a price')
+    if not price.is_finite() or not 0 <= price < 10 ** 8:
+        raise RowError(f'{value!r} is out of range')
+    return price
+
+
+def parse_choice(lookup):
+    def parse(value):
+        try:
+            return lookup[str(value).strip().lower()]
+        except KeyError:
+            raise RowError(f'{value!r} is not one of the choices')
+    return parse
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise RowError(f'{value!r} is not a whole number')
+    if quantity < 0:
+        raise RowError(f'{value!r} is negative')
+    return quantity
+
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError(f'{value!r} is not yes/no')
+
+
+PARSERS = {
+    'description': parse_text,
+    'price': parse_price,
+    'size': parse_choice(SIZES),
+    'color': parse_choice(COLORS),
+    'stock_quantity': parse_quantity,
+    'image_path': lambda value: parse_text(value, 500),
+    'is_featured': parse_flag,
+    'is_new': parse_flag,
+    'is_popular': parse_flag,
+}
+
+# Blank cells of these fields mean an empty value rather than a missing one
+TEXT_FIELDS = ('description', 'image_path')
+
+
+def category_lookup():
+    """Categories by lowercased name, Macedonian name and slug"""
+    lookup = {}
+    for category in Category.objects.all():
+        for key in (category.name, category.name_mk, category.slug):
+            lookup.setdefault(key.lower(), category)
+    return lookup
+
+
+def clean_row(row, categories):
+    """Validate a feed row; return its (name, category) key and the feed fields it sets"""
+    if row is None:
+        raise RowError('not a JSON object')
+    name = parse_text(row.get('name') or '', 200)
+    if not name:
+        raise RowError('name: required')
+    category = categories.get(str(row.get('category') or '').strip().lower())
+    if category is None:
+        raise RowError(f'category: unknown category {row.get("category")!r}')
+
+    values = {}
+    for field, parse in PARSERS.items():
+        value = row.get(field)
+        if value is None or (value == '' and field not in TEXT_FIELDS):
+            continue
+        try:
+            values[field] = parse(value)
+        except RowError as error:
+            raise RowError(f'{field}: {error}')
+    return (name, category), values
+
+
+def build_product(name, category, values):
+    """Unsaved product with the derived fields filled in, as Product.save() would"""
+    product = Product(name=name, category=category, **values)
+    product.availability = product.stock_quantity > 0
+    product.search_text = build_search_text(product.name, product.description)
+    product.sort_rank = category.sort_rank
+    return product
+
+
+def import_batch(batch, stats, dry_run=False, update_existing=True, on_change=None):
+    """Upsert one batch of {(name, category): (line, values)} in its own transaction"""
+    with transaction.atomic():
+        _import_batch(batch, stats, dry_run, update_existing, on_change)
+    stats.batches += 1
+
+
+def _import_batch(batch, stats, dry_run, update_existing, on_change):
+    existing = {
+        (product.name, product.category_id): product
+        for product in Product.objects.filter(
+            name__in={name for name, category in batch},
+            category_id__in={category.pk for name, category in batch},
+        ).only('name', 'category_id', *FEED_FIELDS)
+    }
+
+    products = []
+    for (name, category), (line, values) in batch.items():
+        current = existing.get((name, category.pk))
+        if current is None:
+            missing = [field for field in REQUIRED_FIELDS if field not in values]
+            if missing:
+                stats.error(line, f'{", ".join(missing)}: required for new products')
+                continue
+            products.append(build_product(name, category, values))
+            stats.created += 1
+            if on_change:
+                on_change('+', f'{name} ({category.name})')
+            continue
+
+        changes = {
+            field: (getattr(current, field), value)
+            for field, value in values.items()
+            if getattr(current, field) != value
+        }
+        if not changes or not update_existing:
+            stats.unchanged += 1
+            continue
+        merged = {field: getattr(current, field) for field in FEED_FIELDS}
+        merged.update(values)
+        products.append(build_product(name, category, merged))
+        stats.updated += 1
+        if on_change:
+            diff = ', '.join(f'{field}: {old!r} -> {new!r}' for field, (old, new) in changes.items())
+            on_change('~', f'{name} ({category.name}): {diff}')
+
+    if products and not dry_run:
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['name', 'category'],
+            update_fields=[*FEED_FIELDS, *DERIVED_FIELDS],
+        )
+        # bulk_create skips the product signals that keep the search index
+        # in sync; without the upserted ids, reload the whole index instead
+        if all(product.pk for product in products):
+            index_products([(product.pk, product.search_text) for product in products])
+        else:
+            rebuild_search_index()
+
+
+def import_rows(rows, batch_size=BATCH_SIZE, dry_run=False, update_existing=True, on_change=None):
+    """
+    Import (line, row) pairs in batches and return the ImportStats.
+
+    Every batch commits on its own, so a large feed never holds locks for
+    long; if an import fails, the batches before it stay imported and
+    rerunning the feed skips them as unchanged. Later rows for the same
+    product win. With dry_run nothing is
+    written; on_change(kind, text) still hears about every product that
+    would be added ('+') or changed ('~'). Without update_existing only new
+    products are added.
+
+    Once the import is done, the shared catalog version moves, so the web
+    workers drop their cached pages, snapshots and indexes.
+    """
+    stats = ImportStats()
+    start = time.monotonic()
+    categories = category_lookup()
+
+    try:
+        batch = {}
+        for line, row in rows:
+            stats.rows += 1
+            try:
+                key, values = clean_row(row, categories)
+            except RowError as error:
+                stats.error(line, str(error))
+                continue
+            batch[key] = (line, values)
+            if len(batch) >= batch_size:
+                import_batch(batch, stats, dry_run, update_existing, on_change)
+                batch = {}
+        if batch:
+            import_batch(batch, stats, dry_run, update_existing, on_change)
+    finally:
+        # Also after a failure: the batches before it are in the catalog
+        if not dry_run and (stats.created or stats.updated):
+            transaction.on_commit(products_imported)
+
+    stats.seconds = time.monotonic() - start
+    return stats
+
+
+def products_imported():
+    catalog_changed()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from apps.products.models import Category, Product, catalog_changed
+
+
+class Command(BaseCommand):
+    help = 'Copy category sort ranks onto their products'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Syncing product sort ranks...')
+        
+        # update() bypasses save(), so this is a single statement
+        category_rank = Category.objects.filter(pk=OuterRef('category_id')).values('sort_rank')[:1]
+        updated = Product.objects.exclude(sort_rank=Subquery(category_rank)).update(sort_rank=Subquery(category_rank))
+        if updated:
+            # update() skips the product signals; the version is shared, so
+            # every web worker re-reads the listing order
+            catalog_changed()
+        
+        self.stdout.write(self.style.SUCCESS(f'[OK] Updated {updated} products'))
@@ -0,0 +1,87 @@
+import random
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from apps.products.cache import get_catalog_version
+from apps.products.catalog import CatalogSnapshot
+from apps.products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Compare memory and read latency of the catalog snapshot with the ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500, help='Simulated requests per read')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        
+        # Open the connection and read the catalog version up front so neither
+        # measurement pays for the connection setup or the version query
+        Product.objects.exists()
+        version = get_catalog_version()
+        
+        snapshot, snapshot_bytes, snapshot_build = self.measure(lambda: CatalogSnapshot.build(version))
+        instances, orm_bytes, orm_build = self.measure(
+            lambda: list(Product.objects.filter(availability=True).select_related('category'))
+        )
+        product_ids = list(snapshot.products)
+        if not product_ids:
+            self.stdout.write(self.style.WARNING('No available products to benchmark'))
+            return
+        
+        self.stdout.write(f'{len(product_ids)} available products, {len(snapshot.categories)} categories')
+        self.stdout.write(f'  {"":<24}{"snapshot":>14}{"ORM":>14}')
+        self.stdout.write(f'  {"memory":<24}{snapshot_bytes / 1024:>11.0f} KB{orm_bytes / 1024:>11.0f} KB')
+        self.stdout.write(f'  {"load":<24}{snapshot_build * 1000:>11.1f} ms{orm_build * 1000:>11.1f} ms')
+        
+        rng = random.Random(0)
+        picks = [rng.choice(product_ids) for _ in range(iterations)]
+        pages = [rng.sample(product_ids, min(12, len(product_ids))) for _ in range(iterations)]
+        
+        def snapshot_detail(pk):
+            product = snapshot.get(pk)
+            return product, snapshot.related(product)
+        
+        def orm_detail(pk):
+            product = Product.objects.select_related('category').filter(pk=pk, availability=True).first()
+            related = list(Product.objects.filter(category=product.category, availability=True).exclude(pk=pk))
+            return product, related
+        
+        def orm_home(_):
+            products = Product.objects.filter(availability=True).exclude(category__name='Accessory')
+            return [
+                list(products.filter(is_featured=True)[:6]),
+                list(products.filter(is_new=True)[:6]),
+                list(products.filter(is_popular=True)[:6]),
+            ]
+        
+        reads = [
+            ('product detail', picks, snapshot_detail, orm_detail),
+            ('listing page (12)', pages, snapshot.hydrate, lambda ids: list(Product.objects.select_related('category').in_bulk(ids).values())),
+            ('home sections', picks, lambda _: dict(snapshot.home_sections), orm_home),
+        ]
+        for name, arguments, snapshot_read, orm_read in reads:
+            snapshot_us = self.time_per_call(snapshot_read, arguments)
+            orm_us = self.time_per_call(orm_read, arguments)
+            self.stdout.write(f'  {name:<24}{snapshot_us:>11.1f} us{orm_us:>11.1f} us   ({orm_us / snapshot_us:.0f}x)')
+        
+        self.stdout.write(self.style.SUCCESS(f'[OK] Benchmarked {iterations} reads of each kind'))
+
+    def measure(self, build):
+        """Build something and return it with the memory it holds and the seconds it took"""
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            result = build()
+            seconds = time.perf_counter() - start
+            size, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, size, seconds
+
+    def time_per_call(self, read, arguments):
+        start = time.perf_counter()
+        for argument in arguments:
+            read(argument)
+        return (time.perf_counter() - start) / len(arguments) * 1_000_000
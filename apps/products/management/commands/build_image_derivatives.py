@@ -0,0 +1,89 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from apps.products.images import (
+    file_digest, find_images, generate_derivatives, read_manifest, write_manifest,
+    DERIVATIVE_WIDTHS, MANIFEST_NAME,
+)
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP and JPEG versions of the product pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate all images')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        pictures_dir = str(settings.MEDIA_ROOT)
+        output_dir = str(settings.IMAGE_DERIVATIVES_ROOT)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        manifest = {} if options['force'] else read_manifest()
+        sources = find_images(pictures_dir)
+        
+        # Unchanged files (same size and mtime, same widths) are skipped without reading them
+        pending = {}
+        for image_path, source in sources.items():
+            stat = os.stat(source)
+            entry = manifest.get(image_path)
+            if (
+                entry
+                and entry.get('size') == stat.st_size
+                and entry.get('mtime') == stat.st_mtime_ns
+                and entry.get('widths') == list(DERIVATIVE_WIDTHS)
+                and all(os.path.exists(os.path.join(output_dir, v['webp'])) for v in entry['variants'])
+            ):
+                continue
+            if (
+                entry
+                and entry.get('widths') == list(DERIVATIVE_WIDTHS)
+                and entry.get('hash') == file_digest(source)
+            ):
+                # Touched but not changed (e.g. a fresh checkout)
+                entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+                continue
+            pending[image_path] = (source, stat)
+        
+        self.stdout.write(f'{len(sources)} images, {len(pending)} to process...')
+        
+        errors = 0
+        if pending:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                futures = {
+                    executor.submit(generate_derivatives, source, image_path, output_dir): (image_path, stat)
+                    for image_path, (source, stat) in pending.items()
+                }
+                for future in as_completed(futures):
+                    image_path, stat = futures[future]
+                    try:
+                        entry = future.result()
+                    except Exception as exc:
+                        errors += 1
+                        self.stdout.write(self.style.WARNING(f'  [!] {image_path}: {exc}'))
+                        continue
+                    entry.update(size=stat.st_size, mtime=stat.st_mtime_ns, widths=list(DERIVATIVE_WIDTHS))
+                    manifest[image_path] = entry
+                    self.stdout.write(f'  [+] {image_path}')
+        
+        # Forget removed pictures and delete derivatives nobody references
+        manifest = {path: entry for path, entry in manifest.items() if path in sources}
+        referenced = {MANIFEST_NAME}
+        for entry in manifest.values():
+            for variant in entry['variants']:
+                referenced.update((variant['webp'], variant['jpeg']))
+        removed = 0
+        for name in os.listdir(output_dir):
+            if name not in referenced and not name.endswith('.tmp'):
+                os.remove(os.path.join(output_dir, name))
+                removed += 1
+        
+        write_manifest(manifest)
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Processed {len(pending) - errors} images, removed {removed} stale files in {elapsed:.1f}s'
+        ))
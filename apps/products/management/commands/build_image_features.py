@@ -0,0 +1,96 @@
+import os
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from apps.products.images import file_digest, find_images
+from apps.products.similarity import extract_features, read_index, read_vectors, write_index, FEATURE_DIM
+
+
+class Command(BaseCommand):
+    help = 'Extract feature vectors of the product pictures for "similar looks"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--force', action='store_true', help='Recompute all vectors')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        pictures_dir = str(settings.MEDIA_ROOT)
+        output_dir = str(settings.IMAGE_FEATURES_ROOT)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        index = {} if options['force'] else read_index()
+        vectors = read_vectors(index)
+        entries = index.get('images', {}) if vectors else {}
+        sources = find_images(pictures_dir)
+        
+        # Unchanged files (same size and mtime, or same content) keep their vectors
+        pending = {}
+        touched = False
+        for image_path, source in sources.items():
+            stat = os.stat(source)
+            entry = entries.get(image_path)
+            if entry and image_path in vectors:
+                if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime_ns:
+                    continue
+                if entry.get('hash') == file_digest(source):
+                    # Touched but not changed (e.g. a fresh checkout)
+                    entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+                    touched = True
+                    continue
+            pending[image_path] = (source, stat)
+        
+        self.stdout.write(f'{len(sources)} images, {len(pending)} to process...')
+        
+        errors = 0
+        if pending:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                futures = {
+                    executor.submit(extract_features, source): (image_path, source, stat)
+                    for image_path, (source, stat) in pending.items()
+                }
+                for future in as_completed(futures):
+                    image_path, source, stat = futures[future]
+                    try:
+                        vectors[image_path] = array('f', future.result())
+                    except Exception as exc:
+                        errors += 1
+                        vectors.pop(image_path, None)
+                        self.stdout.write(self.style.WARNING(f'  [!] {image_path}: {exc}'))
+                        continue
+                    entries[image_path] = {'hash': file_digest(source), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+                    self.stdout.write(f'  [+] {image_path}')
+        
+        image_paths = sorted(path for path in sources if path in vectors)
+        if not pending and set(image_paths) == set(entries):
+            if touched:
+                write_index(index)
+            elapsed = time.monotonic() - start
+            self.stdout.write(self.style.SUCCESS(f'[OK] {len(image_paths)} vectors up to date in {elapsed:.1f}s'))
+            return
+        
+        # Write the matrix of the current pictures under a new name, then
+        # switch the index to it; workers still mapping the old file keep it
+        matrix = array('f')
+        images = {}
+        for row, image_path in enumerate(image_paths):
+            matrix.extend(vectors[image_path])
+            images[image_path] = dict(entries[image_path], row=row)
+        
+        vectors_name = f'vectors-{uuid.uuid4().hex[:12]}.f32'
+        with open(os.path.join(output_dir, vectors_name), 'wb') as f:
+            matrix.tofile(f)
+        write_index({'dim': FEATURE_DIM, 'vectors': vectors_name, 'images': images})
+        
+        for name in os.listdir(output_dir):
+            if name.endswith('.f32') and name != vectors_name:
+                os.remove(os.path.join(output_dir, name))
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Processed {len(pending) - errors} images, {len(images)} vectors '
+            f'({len(matrix) * matrix.itemsize // 1024} KB) in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.importer import import_rows, read_feed, BATCH_SIZE, FEED_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Import products from CSV or JSON Lines feeds, adding new ones and updating changed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Feed files (.csv, .jsonl)')
+        parser.add_argument('--format', choices=FEED_FORMATS, help='Feed format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows upserted per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+        parser.add_argument('--no-update', action='store_true', help='Only add new products, leave existing ones as they are')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if dry_run:
+            self.stdout.write('Dry run, nothing will be written')
+        
+        def show_change(kind, text):
+            self.stdout.write(f'  {kind} {text}')
+        
+        failed = False
+        changed = False
+        for path in options['paths']:
+            self.stdout.write(f'Importing {path}...')
+            try:
+                stats = import_rows(
+                    read_feed(path, options['format']),
+                    batch_size=options['batch_size'],
+                    dry_run=dry_run,
+                    update_existing=not options['no_update'],
+                    on_change=show_change if dry_run or options['verbosity'] > 1 else None,
+                )
+            except OSError as exc:
+                raise CommandError(f'Cannot read {path}: {exc}')
+            
+            for line, message in stats.errors:
+                self.stdout.write(self.style.WARNING(f'  [!] line {line}: {message}'))
+            if stats.invalid > len(stats.errors):
+                self.stdout.write(self.style.WARNING(f'  [!] ... and {stats.invalid - len(stats.errors)} more invalid rows'))
+            failed = failed or stats.invalid
+            changed = changed or stats.created or stats.updated
+            
+            verb = 'Would import' if dry_run else 'Imported'
+            self.stdout.write(self.style.SUCCESS(f'[OK] {verb} {stats}'))
+        
+        if changed and not dry_run:
+            self.stdout.write(f'The site shows the changes within {settings.CATALOG_VERSION_CHECK_INTERVAL:g}s')
+        if failed:
+            self.stdout.write(self.style.WARNING('Some rows were invalid and skipped'))
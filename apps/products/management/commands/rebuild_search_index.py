@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from apps.products.models import Product
+from apps.products.search import build_search_text, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute product search text and reload the search index'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding product search index...')
+        
+        products = list(Product.objects.only('id', 'name', 'description', 'search_text'))
+        changed = []
+        for product in products:
+            search_text = build_search_text(product.name, product.description)
+            if product.search_text != search_text:
+                product.search_text = search_text
+                changed.append(product)
+        
+        # bulk_update skips save(), so the FTS table is reloaded afterwards
+        Product.objects.bulk_update(changed, ['search_text'], batch_size=500)
+        rebuild_search_index()
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Indexed {len(products)} products ({len(changed)} updated)'
+        ))
@@ -2,7 +2,14 @@ import os
 import random
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from apps.products.models import Category, Product
+from django.db import transaction
+from apps.products.importer import import_rows, products_imported
+from apps.products.pictures import (
+    diff_pictures, manifest_is_current, rename_products, retire_products,
+    save_manifest, scan_pictures, tree_fingerprint,
+)
+from apps.products.search import rebuild_search_index
+from apps.products.models import Category
 from apps.delivery.models import DeliveryOption
 from apps.recommendations.models import RecommendationRule
 
@@ -31,19 +38,19 @@ class Command(BaseCommand):
         self.stdout.write('Creating categories...')
         
         category_data = [
-            ('Wedding Dress', 'Венчаница', 'wedding-dress'),
-            ('Formal Dress', 'Свечен Фустан', 'formal-dress'),
-            ('Suit', 'Костум', 'suit'),
-            ('Accessory', 'Додаток', 'accessory'),
-            ('Women Winter Coat', 'Женски Капут', 'women-winter-coat'),
-            ('Men Winter Coat', 'Машки Капут', 'men-winter-coat'),
+            ('Wedding Dress', 'Венчаница', 'wedding-dress', 1),
+            ('Formal Dress', 'Свечен Фустан', 'formal-dress', 2),
+            ('Suit', 'Костум', 'suit', 3),
+            ('Accessory', 'Додаток', 'accessory', 5),
+            ('Women Winter Coat', 'Женски Капут', 'women-winter-coat', 4),
+            ('Men Winter Coat', 'Машки Капут', 'men-winter-coat', 4),
         ]
         
         categories = {}
-        for name, name_mk, slug in category_data:
+        for name, name_mk, slug, sort_rank in category_data:
             category, created = Category.objects.get_or_create(
                 name=name,
-                defaults={'name_mk': name_mk, 'slug': slug}
+                defaults={'name_mk': name_mk, 'slug': slug, 'sort_rank': sort_rank}
             )
             categories[name] = category
             if created:
@@ -117,7 +124,18 @@ class Command(BaseCommand):
         colors_suit = ['црна', 'сина', 'сива', 'темно-сина']
         colors_accessory = ['златна', 'сребрена', 'црна', 'бела']
         
-        product_count = 0
+        # Compare pictures/ with the manifest of the last run; unchanged means nothing to do
+        files = scan_pictures(pictures_dir, folder_mapping)
+        fingerprint = tree_fingerprint(files)
+        if manifest_is_current(fingerprint):
+            self.stdout.write(f'  Pictures unchanged ({len(files)} files), skipping products')
+            return
+        
+        diff = diff_pictures(pictures_dir, files)
+        self.stdout.write(f'  Pictures: {diff}')
+        added = set(diff.added)
+        
+        rows = []
         
         for folder_name, category_name in folder_mapping.items():
             folder_path = os.path.join(pictures_dir, folder_name)
@@ -128,8 +146,8 @@ class Command(BaseCommand):
             
             category = categories[category_name]
             
-            # Get all image files
-            image_files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+            # Only pictures that are new since the last run
+            image_files = [path.split('/', 1)[1] for path in files if path.startswith(f'{folder_name}/') and path in added]
             
             for image_file in image_files:
                 # Extract product name from filename (without extension)
@@ -166,41 +184,50 @@ class Command(BaseCommand):
                 # Create relative image path
                 image_path = f"{folder_name}/{image_file}"
                 
-                # Check if product already exists
-                if not Product.objects.filter(name=product_name, category=category).exists():
-                    # Determine if featured/new/popular
-                    is_featured = random.random() < 0.2  # 20% chance
-                    is_new = random.random() < 0.3  # 30% chance
-                    is_popular = random.random() < 0.25  # 25% chance
-                    
-                    # Create appropriate description based on category
-                    if category_name == 'Women Winter Coat':
-                        description = f"Елегантен женски капут од нашата ексклузивна колекција."
-                    elif category_name == 'Men Winter Coat':
-                        description = f"Елегантен машки капут од нашата ексклузивна колекција."
-                    elif category_name == 'Accessory':
-                        description = f"Елегантен додаток со уникатен дизајн."
-                    else:
-                        description = f"Елегантен {category.name_mk.lower()} од нашата ексклузивна колекција."
-                    
-                    Product.objects.create(
-                        name=product_name,
-                        category=category,
-                        description=description,
-                        price=price,
-                        size=size,
-                        color=color,
-                        availability=True,
-                        image_path=image_path,
-                        is_featured=is_featured,
-                        is_new=is_new,
-                        is_popular=is_popular,
-                    )
-                    product_count += 1
+                # Create appropriate description based on category
+                if category_name == 'Women Winter Coat':
+                    description = f"Елегантен женски капут од нашата ексклузивна колекција."
+                elif category_name == 'Men Winter Coat':
+                    description = f"Елегантен машки капут од нашата ексклузивна колекција."
+                elif category_name == 'Accessory':
+                    description = f"Елегантен додаток со уникатен дизајн."
+                else:
+                    description = f"Елегантен {category.name_mk.lower()} од нашата ексклузивна колекција."
+                
+                rows.append({
+                    'name': product_name,
+                    'category': category_name,
+                    'description': description,
+                    'price': price,
+                    'size': size,
+                    'color': color,
+                    'stock_quantity': random.randint(2, 10),
+                    'image_path': image_path,
+                    'is_featured': random.random() < 0.2,  # 20% chance
+                    'is_new': random.random() < 0.3,  # 30% chance
+                    'is_popular': random.random() < 0.25,  # 25% chance
+                })
             
-            self.stdout.write(f'  [+] Processed {category_name}: {len(image_files)} products')
+            if image_files:
+                self.stdout.write(f'  [+] Processed {category_name}: {len(image_files)} new pictures')
+        
+        with transaction.atomic():
+            # Products that already exist keep their (randomly picked) details
+            stats = import_rows(enumerate(rows, start=1), update_existing=False)
+            renamed = rename_products(diff.renamed)
+            retired = retire_products(diff.removed)
+            if renamed or retired:
+                # update() and bulk_update() skip the product signals
+                rebuild_search_index()
+                transaction.on_commit(products_imported)
+            save_manifest(diff, fingerprint, files)
+        
+        for line, message in stats.errors:
+            self.stdout.write(self.style.WARNING(f'  ! {rows[line - 1]["name"]}: {message}'))
         
-        self.stdout.write(self.style.SUCCESS(f'[OK] Created {product_count} products'))
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Created {stats.created} products, renamed {renamed}, took {retired} out of stock'
+        ))
 
     def create_recommendation_rules(self, categories):
         self.stdout.write('Creating recommendation rules...')
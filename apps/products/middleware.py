@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+from django.utils.encoding import filepath_to_uri
+from .images import PICTURES_PREFIX
+
+
+class ProductImageRedirectMiddleware:
+    """
+    Redirect old unhashed product picture URLs to their fingerprinted name.
+
+    Must come before WhiteNoise, which would otherwise serve the unhashed
+    copy with a short cache lifetime.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = f'{settings.STATIC_URL}{PICTURES_PREFIX}/'
+
+    def __call__(self, request):
+        if request.path.startswith(self.prefix):
+            # Only manifest storages know the hashed names
+            hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+            hashed_name = hashed_files.get(request.path[len(settings.STATIC_URL):])
+            if hashed_name:
+                response = HttpResponseRedirect(settings.STATIC_URL + filepath_to_uri(hashed_name))
+                # The target changes whenever the picture does
+                patch_cache_control(response, public=True, max_age=86400)
+                return response
+        return self.get_response(request)
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:33
+
+from django.db import migrations, models
+from apps.products.search import build_search_text, FTS_TABLE
+
+
+def backfill_search_text(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.only('id', 'name', 'description'))
+    for product in products:
+        product.search_text = build_search_text(product.name, product.description)
+    Product.objects.bulk_update(products, ['search_text'], batch_size=500)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            "CREATE INDEX products_product_search_tsv ON products_product "
+            "USING GIN (to_tsvector('simple', search_text))"
+        )
+        schema_editor.execute(
+            'CREATE INDEX products_product_search_trgm ON products_product '
+            'USING GIN (search_text gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(search_text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, search_text) SELECT id, search_text FROM products_product'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS products_product_search_tsv')
+        schema_editor.execute('DROP INDEX IF EXISTS products_product_search_trgm')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False, help_text='Normalized name and description for search'),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
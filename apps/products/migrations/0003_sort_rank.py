@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+def backfill_sort_rank(apps, schema_editor):
+    """Ranks matching the order product_list used to compute per request"""
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    ranks = {'Wedding Dress': 1, 'Formal Dress': 2, 'Suit': 3, 'Accessory': 5}
+    for category in Category.objects.all():
+        if category.name in ranks:
+            category.sort_rank = ranks[category.name]
+        elif 'coat' in category.name.lower():
+            category.sort_rank = 4
+        else:
+            category.sort_rank = 6
+        category.save(update_fields=['sort_rank'])
+        Product.objects.filter(category=category).update(sort_rank=category.sort_rank)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='sort_rank',
+            field=models.PositiveSmallIntegerField(default=6, help_text='Position in product listings (lower is shown first)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sort_rank',
+            field=models.PositiveSmallIntegerField(default=6, editable=False),
+        ),
+        migrations.RunPython(backfill_sort_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['availability', 'sort_rank', '-created_at'], name='products_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+# Products were sold without a stock count before. Available ones start
+# with this many pieces, so a single order doesn't sell them out; enter the
+# real counts in the admin (or with import_catalog) after migrating.
+UNTRACKED_STOCK = 10
+
+
+def backfill_stock(apps, schema_editor):
+    """Products switched off by hand are out of stock"""
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(availability=False).update(stock_quantity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_sort_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_quantity',
+            field=models.PositiveIntegerField(default=UNTRACKED_STOCK, help_text='Pieces in stock'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='availability',
+            field=models.BooleanField(default=True, editable=False, help_text='Set from the stock quantity'),
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
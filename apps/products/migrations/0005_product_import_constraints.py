@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicates(apps, schema_editor):
+    """Tell apart products that share a name within a category by their id"""
+    Product = apps.get_model('products', 'Product')
+    duplicates = (
+        Product.objects.values('name', 'category_id')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        products = Product.objects.filter(name=duplicate['name'], category_id=duplicate['category_id']).order_by('id')
+        for product in products[1:]:
+            suffix = f' #{product.pk}'
+            Product.objects.filter(pk=product.pk).update(name=product.name[:200 - len(suffix)] + suffix)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_stock_quantity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='size',
+            field=models.CharField(choices=[('XS', 'XS'), ('S', 'S'), ('M', 'M'), ('L', 'L'), ('XL', 'XL'), ('XXL', 'XXL'), ('36', '36'), ('38', '38'), ('40', '40'), ('42', '42'), ('44', '44'), ('46', '46'), ('48', '48'), ('50', '50'), ('52', '52'), ('54', '54'), ('56', '56'), ('универзална', 'Универзална')], max_length=20),
+        ),
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('name', 'category'), name='products_name_category_unique'),
+        ),
+    ]
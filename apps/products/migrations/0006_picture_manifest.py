@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_import_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Picture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Path under the pictures folder', max_length=500, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.BigIntegerField(help_text='Modification time in nanoseconds')),
+                ('content_hash', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PictureScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('files', models.PositiveIntegerField(default=0)),
+                ('scanned_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-scanned_at', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='picture',
+            name='mtime',
+        ),
+    ]
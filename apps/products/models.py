@@ -1,11 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.text import slugify
+from .cache import bump_catalog_version
+from .images import original_url
+from .search import build_search_text, index_product, unindex_product
 
 class Category(models.Model):
     """Product categories: Wedding Dress, Formal Dress, Suit, Accessory, etc."""
     name = models.CharField(max_length=100, unique=True)
     name_mk = models.CharField(max_length=100, help_text="Macedonian name")
     slug = models.SlugField(unique=True, blank=True)
+    sort_rank = models.PositiveSmallIntegerField(default=6, help_text="Position in product listings (lower is shown first)")
     
     class Meta:
         verbose_name_plural = "Categories"
@@ -15,6 +21,8 @@ class Category(models.Model):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        # Keep the denormalized rank on products in sync
+        self.products.exclude(sort_rank=self.sort_rank).update(sort_rank=self.sort_rank)
     
     def __str__(self):
         return self.name_mk
@@ -39,6 +47,8 @@ class Product(models.Model):
         ('48', '48'),
         ('50', '50'),
         ('52', '52'),
+        ('54', '54'),
+        ('56', '56'),
         ('универзална', 'Универзална'),
     ]
     
@@ -68,14 +78,19 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     size = models.CharField(max_length=20, choices=SIZE_CHOICES)
     color = models.CharField(max_length=50, choices=COLOR_CHOICES)
-    availability = models.BooleanField(default=True)
+    stock_quantity = models.PositiveIntegerField(help_text="Pieces in stock")
+    availability = models.BooleanField(default=True, editable=False, help_text="Set from the stock quantity")
     image_path = models.CharField(max_length=500, help_text="Path to product image")
+    search_text = models.TextField(blank=True, editable=False, help_text="Normalized name and description for search")
     
     # Additional fields
     is_featured = models.BooleanField(default=False, help_text="Show in featured products")
     is_new = models.BooleanField(default=False, help_text="Show in new collection")
     is_popular = models.BooleanField(default=False, help_text="Show in popular models")
     
+    # Copy of category.sort_rank so listings can be ordered from an index
+    sort_rank = models.PositiveSmallIntegerField(default=6, editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -84,11 +99,81 @@ class Product(models.Model):
         indexes = [
             models.Index(fields=['category', 'availability']),
             models.Index(fields=['is_featured', 'is_new', 'is_popular']),
+            models.Index(fields=['availability', 'sort_rank', '-created_at'], name='products_listing_idx'),
+        ]
+        constraints = [
+            # Identity of a product in catalog feeds (manage.py import_catalog)
+            models.UniqueConstraint(fields=['name', 'category'], name='products_name_category_unique'),
         ]
     
+    def save(self, *args, **kwargs):
+        self.availability = self.stock_quantity > 0
+        self.search_text = build_search_text(self.name, self.description)
+        if self.category_id:
+            self.sort_rank = self.category.sort_rank
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"{self.name} ({self.category.name})"
     
     def get_image_url(self):
         """Return the URL path for the product image"""
-        return f"/static/products/{self.image_path}"
+        return original_url(self.image_path)
+
+
+class Picture(models.Model):
+    """A product picture seed_products has seen, as it was on disk then"""
+    path = models.CharField(max_length=500, unique=True, help_text="Path under the pictures folder")
+    size = models.BigIntegerField()
+    content_hash = models.CharField(max_length=64)
+    
+    def __str__(self):
+        return self.path
+
+
+class PictureScan(models.Model):
+    """Fingerprint of the whole pictures tree at a seed run"""
+    fingerprint = models.CharField(max_length=64)
+    files = models.PositiveIntegerField(default=0)
+    scanned_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-scanned_at', '-id']
+
+
+class CatalogVersion(models.Model):
+    """Version of the catalog data, a single row shared by all processes"""
+    version = models.BigIntegerField()
+    modified = models.DateTimeField(help_text="When the catalog last changed")
+    
+    def __str__(self):
+        return str(self.version)
+
+
+def catalog_changed(saved=None, deleted_id=None):
+    """Bump the catalog version and patch this worker's facet index"""
+    from .facets import apply_product_change
+    version = bump_catalog_version()
+    if saved is not None or deleted_id is not None:
+        apply_product_change(version, saved, deleted_id)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """Invalidate cached catalog data once the change is committed"""
+    index_product(instance.pk, instance.search_text)
+    transaction.on_commit(lambda: catalog_changed(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Invalidate cached catalog data once the delete is committed"""
+    product_id = instance.pk  # The pk is cleared once the delete finishes
+    unindex_product(product_id)
+    transaction.on_commit(lambda: catalog_changed(deleted_id=product_id))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    """Invalidate cached catalog data once the change is committed"""
+    transaction.on_commit(catalog_changed)
@@ -0,0 +1,138 @@
+"""
+Manifest of the product pictures the catalog was seeded from.
+
+The Picture table keeps the path, size and content hash of every picture
+seed_products has seen, and PictureScan a fingerprint of the whole tree.
+Only relative paths and sizes go into the fingerprint: a fresh checkout
+gives every file a new mtime, and that alone shouldn't reseed. When
+pictures/ hasn't changed since the last run, a deploy costs one stat per
+file and one query; otherwise only the added, removed and renamed
+pictures are applied.
+"""
+import hashlib
+import os
+from django.db import transaction
+from .images import IMAGE_EXTENSIONS, file_digest
+from .models import Picture, PictureScan, Product
+from .search import build_search_text
+
+
+class PictureDiff:
+    """What changed in the pictures tree since the manifest was written"""
+
+    def __init__(self):
+        self.added = []     # new paths
+        self.removed = []   # paths that are gone
+        self.renamed = {}   # old path -> new path, same content
+        self.changed = []   # Picture rows with new stat or content, to save
+        self.created = []   # Picture rows to create
+
+    def __str__(self):
+        return f'{len(self.added)} added, {len(self.removed)} removed, {len(self.renamed)} renamed'
+
+
+def scan_pictures(pictures_dir, folders):
+    """{path: size} of the pictures directly inside the given folders"""
+    files = {}
+    for folder in folders:
+        try:
+            entries = os.scandir(os.path.join(pictures_dir, folder))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    files[f'{folder}/{entry.name}'] = entry.stat().st_size
+    return files
+
+
+def tree_fingerprint(files):
+    digest = hashlib.sha256()
+    for path, size in sorted(files.items()):
+        digest.update(f'{path}\0{size}\n'.encode())
+    return digest.hexdigest()
+
+
+def manifest_is_current(fingerprint):
+    """True when the pictures are exactly as they were at the last seed"""
+    scan = PictureScan.objects.only('fingerprint').first()
+    return scan is not None and scan.fingerprint == fingerprint
+
+
+def diff_pictures(pictures_dir, files):
+    """
+    Compare the scanned files with the manifest.
+
+    Only new files and files whose size changed are read to hash them. A file that disappeared and one that showed up with the same
+    content count as a rename.
+    """
+    known = {picture.path: picture for picture in Picture.objects.all()}
+    diff = PictureDiff()
+
+    added = {}
+    for path, size in files.items():
+        picture = known.get(path)
+        if picture is not None and picture.size == size:
+            continue
+        content_hash = file_digest(os.path.join(pictures_dir, path))
+        if picture is None:
+            added[path] = Picture(path=path, size=size, content_hash=content_hash)
+        else:
+            picture.size, picture.content_hash = size, content_hash
+            diff.changed.append(picture)
+
+    removed_by_hash = {}
+    for path, picture in known.items():
+        if path not in files:
+            removed_by_hash.setdefault(picture.content_hash, []).append(path)
+
+    for path, picture in added.items():
+        old_paths = removed_by_hash.get(picture.content_hash)
+        if old_paths:
+            old_path = old_paths.pop()
+            diff.renamed[old_path] = path
+            # Keep the row, under the new path
+            known[old_path].path, known[old_path].size = path, picture.size
+            diff.changed.append(known[old_path])
+        else:
+            diff.added.append(path)
+            diff.created.append(picture)
+    diff.removed = [path for paths in removed_by_hash.values() for path in paths]
+    return diff
+
+
+def rename_products(renamed):
+    """
+    Point products at the new paths of renamed pictures.
+
+    Products still named after their old file take the new file name too,
+    so a later full seed doesn't add them again.
+    """
+    if not renamed:
+        return 0
+    products = list(Product.objects.filter(image_path__in=renamed).only('name', 'description', 'image_path'))
+    for product in products:
+        old_stem = os.path.splitext(os.path.basename(product.image_path))[0]
+        product.image_path = renamed[product.image_path]
+        if product.name == old_stem:
+            product.name = os.path.splitext(os.path.basename(product.image_path))[0]
+        product.search_text = build_search_text(product.name, product.description)
+    Product.objects.bulk_update(products, ['name', 'image_path', 'search_text'])
+    return len(products)
+
+
+def retire_products(removed):
+    """Take products whose picture is gone out of stock; orders still point at them"""
+    if not removed:
+        return 0
+    return Product.objects.filter(image_path__in=removed, stock_quantity__gt=0).update(
+        stock_quantity=0, availability=False,
+    )
+
+
+def save_manifest(diff, fingerprint, files):
+    with transaction.atomic():
+        Picture.objects.filter(path__in=diff.removed).delete()
+        Picture.objects.bulk_update(diff.changed, ['path', 'size', 'content_hash'])
+        Picture.objects.bulk_create(diff.created)
+        PictureScan.objects.create(fingerprint=fingerprint, files=len(files))
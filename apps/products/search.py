@@ -0,0 +1,127 @@
+"""
+Product full-text search.
+
+Product names and descriptions are stored in ``Product.search_text`` in a
+normalized form: Macedonian Cyrillic is transliterated to Latin and
+diacritics and Latin digraphs are folded, so "венчаница", "venchanica" and
+"vencanica" all end up as the same token. Queries go through the same
+normalizer.
+
+The column is indexed per database backend:
+
+* PostgreSQL - GIN index on ``to_tsvector('simple', search_text)`` for
+  ranked prefix matching, plus a trigram GIN index for typos.
+* SQLite - an FTS5 table kept in sync from the product save/delete signals.
+"""
+import re
+import unicodedata
+from django.db import connection
+
+
+FTS_TABLE = 'products_product_fts'
+
+# Maximum number of matches returned for a single query
+SEARCH_LIMIT = 1000
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'ѓ': 'g', 'е': 'e',
+    'ж': 'z', 'з': 'z', 'ѕ': 'dz', 'и': 'i', 'ј': 'j', 'к': 'k', 'л': 'l',
+    'љ': 'l', 'м': 'm', 'н': 'n', 'њ': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'ќ': 'k', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c',
+    'ч': 'c', 'џ': 'dz', 'ш': 's',
+    # Serbian/Russian letters that show up in typed queries
+    'ђ': 'dj', 'ћ': 'c', 'й': 'j', 'щ': 'st', 'ъ': '', 'ы': 'i', 'ь': '',
+    'э': 'e', 'ю': 'ju', 'я': 'ja', 'ё': 'e',
+}
+
+# Latin spellings of the Macedonian letters folded like their Cyrillic forms
+LATIN_DIGRAPHS = [
+    ('dzh', 'dz'), ('ch', 'c'), ('sh', 's'), ('zh', 'z'),
+    ('gj', 'g'), ('kj', 'k'), ('lj', 'l'), ('nj', 'n'),
+]
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    """Fold text to the Latin search form used for both documents and queries"""
+    text = (text or '').lower()
+    text = ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in text)
+    # Strip diacritics: č -> c, é -> e
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    for digraph, replacement in LATIN_DIGRAPHS:
+        text = text.replace(digraph, replacement)
+    return ' '.join(TOKEN_RE.findall(text))
+
+
+def build_search_text(*fields):
+    return normalize(' '.join(field for field in fields if field))
+
+
+def search_product_ids(query, limit=SEARCH_LIMIT):
+    """Return ids of products matching the query, best match first"""
+    tokens = normalize(query).split()
+    if not tokens:
+        return []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            tsquery = ' & '.join(f'{token}:*' for token in tokens)
+            phrase = ' '.join(tokens)
+            cursor.execute(
+                """
+                SELECT id FROM products_product
+                WHERE to_tsvector('simple', search_text) @@ to_tsquery('simple', %s)
+                   OR %s <%% search_text
+                ORDER BY ts_rank(to_tsvector('simple', search_text), to_tsquery('simple', %s))
+                         + word_similarity(%s, search_text) DESC, id
+                LIMIT %s
+                """,
+                [tsquery, phrase, tsquery, phrase, limit],
+            )
+        elif connection.vendor == 'sqlite':
+            match = ' '.join(f'"{token}"*' for token in tokens)
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [match, limit],
+            )
+        else:
+            conditions = ' AND '.join(['search_text LIKE %s'] * len(tokens))
+            cursor.execute(
+                f'SELECT id FROM products_product WHERE {conditions} ORDER BY id LIMIT %s',
+                [f'%{token}%' for token in tokens] + [limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def index_product(product_id, search_text):
+    """Keep the SQLite FTS table in sync with a saved product"""
+    index_products([(product_id, search_text)])
+
+
+def index_products(rows):
+    """Keep the SQLite FTS table in sync with bulk written (id, search_text) rows"""
+    if connection.vendor != 'sqlite' or not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[product_id] for product_id, text in rows])
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, search_text) VALUES (%s, %s)', rows)
+
+
+def unindex_product(product_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_search_index():
+    """Reload the SQLite FTS table from products_product"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, search_text) SELECT id, search_text FROM products_product'
+        )
@@ -0,0 +1,180 @@
+"""
+Visual similarity of product pictures.
+
+build_image_features extracts a small feature vector from every picture
+(a color histogram and a coarse grayscale thumbnail), scaled to unit length
+so cosine similarity is a plain dot product. The vectors are stored as one
+float32 matrix file that web workers memory-map, next to a JSON index of
+the row of each picture.
+"""
+import json
+import math
+import os
+from array import array
+from datetime import datetime, timezone
+from heapq import nlargest
+from mmap import mmap, ACCESS_READ
+from operator import mul
+from django.conf import settings
+
+
+# 4 levels per RGB channel -> 64 color bins, plus an 8x8 grayscale thumbnail
+COLOR_LEVELS = 4
+THUMBNAIL_SIZE = 8
+FEATURE_DIM = COLOR_LEVELS ** 3 + THUMBNAIL_SIZE ** 2
+
+# Share of the similarity that comes from colors; the rest is shape
+COLOR_WEIGHT = 0.7
+
+INDEX_NAME = 'index.json'
+
+
+def normalize(values):
+    length = math.sqrt(sum(value * value for value in values))
+    return [value / length for value in values] if length else values
+
+
+def extract_features(source):
+    """
+    Feature vector of one picture, as a plain list of floats.
+
+    Runs in a worker process, like generate_derivatives.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original:
+        original.draft('RGB', (64, 64))
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    # Square roots of the bin shares, so cosine compares like the Hellinger distance
+    step = 256 // COLOR_LEVELS
+    histogram = [0] * COLOR_LEVELS ** 3
+    for r, g, b in image.resize((32, 32), Image.BILINEAR).getdata():
+        histogram[((r // step) * COLOR_LEVELS + g // step) * COLOR_LEVELS + b // step] += 1
+    color = normalize([math.sqrt(count) for count in histogram])
+
+    # Brightness layout without the overall brightness
+    thumbnail = list(image.convert('L').resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX).getdata())
+    mean = sum(thumbnail) / len(thumbnail)
+    shape = normalize([value - mean for value in thumbnail])
+
+    color_scale = math.sqrt(COLOR_WEIGHT)
+    shape_scale = math.sqrt(1 - COLOR_WEIGHT)
+    return [value * color_scale for value in color] + [value * shape_scale for value in shape]
+
+
+def index_path():
+    return os.path.join(settings.IMAGE_FEATURES_ROOT, INDEX_NAME)
+
+
+def read_index():
+    """Feature index: {'dim', 'vectors' file name, 'images': path -> row, hash and stat}"""
+    try:
+        with open(index_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_index(index):
+    path = index_path()
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def read_vectors(index):
+    """All vectors of a feature index as {image path: array('f')}"""
+    if not index.get('vectors') or index.get('dim') != FEATURE_DIM:
+        return {}
+    matrix = array('f')
+    try:
+        with open(os.path.join(settings.IMAGE_FEATURES_ROOT, index['vectors']), 'rb') as f:
+            matrix.frombytes(f.read())
+    except OSError:
+        return {}
+    return {
+        image_path: matrix[entry['row'] * FEATURE_DIM:(entry['row'] + 1) * FEATURE_DIM]
+        for image_path, entry in index['images'].items()
+        if (entry['row'] + 1) * FEATURE_DIM <= len(matrix)
+    }
+
+
+class SimilarityIndex:
+    """Memory-mapped feature matrix of the pictures, read by the web workers"""
+
+    def __init__(self, rows, vectors, version='', modified=None):
+        self.rows = rows          # image path -> row
+        self.vectors = vectors    # flat float32 view of the matrix
+        self.version = version    # name of the matrix file, new on every rebuild
+        self.modified = modified  # when the matrix was written
+        self.cache = {}         # image path -> its vector as a tuple
+        self.scores = {}        # image path -> {other image path: similarity}
+
+    @classmethod
+    def load(cls):
+        index = read_index()
+        empty = cls({}, memoryview(b'').cast('f'))
+        if not index.get('vectors') or index.get('dim') != FEATURE_DIM:
+            return empty
+        try:
+            with open(os.path.join(settings.IMAGE_FEATURES_ROOT, index['vectors']), 'rb') as f:
+                stat = os.fstat(f.fileno())
+                # The mapping stays valid after the file is replaced by a rebuild
+                buffer = mmap(f.fileno(), 0, access=ACCESS_READ) if stat.st_size else b''
+        except OSError:
+            return empty
+        return cls(
+            {image_path: entry['row'] for image_path, entry in index['images'].items()},
+            memoryview(buffer).cast('f'),
+            index['vectors'],
+            datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+        )
+
+    def vector(self, image_path):
+        vector = self.cache.get(image_path)
+        if vector is None:
+            row = self.rows.get(image_path)
+            if row is None or (row + 1) * FEATURE_DIM > len(self.vectors):
+                return None
+            vector = self.cache[image_path] = tuple(self.vectors[row * FEATURE_DIM:(row + 1) * FEATURE_DIM])
+        return vector
+
+    def most_similar(self, image_path, candidates, limit):
+        """
+        The limit candidates whose pictures look most like the given one.
+
+        Candidates are objects with an image_path; the ones without features
+        go last, in their original order.
+        """
+        target = self.vector(image_path)
+        if target is None:
+            return list(candidates)[:limit]
+        # Pictures don't change while the index is loaded, so each pair is computed once
+        scores = self.scores.setdefault(image_path, {})
+        scored = []
+        for position, candidate in enumerate(candidates):
+            score = scores.get(candidate.image_path)
+            if score is None:
+                vector = self.vector(candidate.image_path)
+                score = scores[candidate.image_path] = sum(map(mul, target, vector)) if vector is not None else -2.0
+            scored.append((score, -position, candidate))
+        return [candidate for score, position, candidate in nlargest(limit, scored, key=lambda entry: entry[:2])]
+
+
+_index = None
+_index_mtime = None
+
+
+def get_similarity_index():
+    """This worker's similarity index, reloaded when the features are rebuilt"""
+    global _index, _index_mtime
+    try:
+        mtime = os.stat(index_path()).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _index is None or mtime != _index_mtime:
+        _index = SimilarityIndex.load()
+        _index_mtime = mtime
+    return _index
@@ -0,0 +1,178 @@
+"""
+Static files storage that remembers what it already hashed and compressed.
+
+collectstatic hands every static file to post_process on every build, so
+WhiteNoise's manifest storage re-reads the whole pictures/ tree to hash it
+and gzips/brotlis every stylesheet and script again. This storage keeps a
+cache next to STATIC_ROOT, keyed by the files' relative names so it still
+applies after a fresh checkout:
+
+- file hashes, by size and mtime; a file whose mtime moved (as after a
+  fresh checkout) is read and hashed again, which is cheap
+- compressed outputs, by size and content hash, so files whose content
+  is unchanged are never compressed again, whatever their mtime
+
+Files that do need work are hashed and compressed in a thread pool
+(hashlib, zlib and brotli release the GIL while they work).
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files import File
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class CachedCompressedManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """CompressedManifestStaticFilesStorage that skips unchanged files"""
+
+    workers = os.cpu_count()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hash_cache = None
+        self.seen = None
+        self.source_hashes = None
+        self.saved_seconds = 0.0
+        self.reused = {'hashes': 0, 'compressed': 0}
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run=dry_run, **options)
+            return
+
+        start = time.monotonic()
+        self.load_hash_cache()
+        self.hash_sources(paths)
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        self.save_hash_cache()
+        self.log(
+            f'Post-processed in {time.monotonic() - start:.1f}s, reused {self.reused["hashes"]} hashes and '
+            f'{self.reused["compressed"]} compressed files (saved ~{self.saved_seconds:.1f}s)'
+        )
+
+    def load_hash_cache(self):
+        try:
+            with open(settings.STATICFILES_HASH_CACHE, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        # name -> [size, mtime, hash, seconds]; name -> [size, hash, compressed names, seconds]
+        self.hash_cache = {'hashes': cache.get('hashes', {}), 'compressed': cache.get('compressed', {})}
+        self.seen = {'hashes': set(), 'compressed': set()}
+        # absolute path of a source or its collected copy -> hash, for file_hash()
+        self.source_hashes = {}
+        self.saved_seconds = 0.0
+        self.reused = {'hashes': 0, 'compressed': 0}
+
+    def save_hash_cache(self):
+        # Forget files that weren't part of this build
+        cache = {
+            kind: {key: entry for key, entry in entries.items() if key in self.seen[kind]}
+            for kind, entries in self.hash_cache.items()
+        }
+        path = str(settings.STATICFILES_HASH_CACHE)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, path)
+        self.hash_cache = self.seen = self.source_hashes = None
+
+    def hash_sources(self, paths):
+        """
+        Hash the source files up front, in parallel.
+
+        Files with the size and mtime of their cache entry aren't read.
+        """
+        pending = []
+        for name, (storage, path) in paths.items():
+            try:
+                source = storage.path(path)
+                stat = os.stat(source)
+            except (NotImplementedError, OSError):
+                continue
+            self.seen['hashes'].add(name)
+            entry = self.hash_cache['hashes'].get(name)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self.saved_seconds += entry[3]
+                self.reused['hashes'] += 1
+                self.remember_hash(name, source, entry[2])
+            else:
+                pending.append((name, source, stat))
+
+        def hash_file(name, source, stat):
+            start = time.monotonic()
+            with File(open(source, 'rb'), source) as content:
+                file_hash = super(CachedCompressedManifestStaticFilesStorage, self).file_hash(source, content)
+            return name, source, [stat.st_size, stat.st_mtime_ns, file_hash, time.monotonic() - start]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for name, source, entry in executor.map(lambda args: hash_file(*args), pending):
+                self.hash_cache['hashes'][name] = entry
+                self.remember_hash(name, source, entry[2])
+
+    def remember_hash(self, name, source, file_hash):
+        """Let file_hash() answer for the source file and its copy in STATIC_ROOT"""
+        self.source_hashes[source] = self.source_hashes[self.path(name)] = file_hash
+
+    def file_hash(self, name, content=None):
+        # Files read from disk have their absolute path as name; rewritten
+        # stylesheets come as ContentFiles without one and are hashed as usual
+        source = getattr(content, 'name', None)
+        if self.source_hashes and source in self.source_hashes:
+            return self.source_hashes[source]
+        return super().file_hash(name, content)
+
+    def compress_files(self, names):
+        extensions = getattr(settings, 'WHITENOISE_SKIP_COMPRESS_EXTENSIONS', None)
+        compressor = self.create_compressor(extensions=extensions, quiet=True)
+
+        hashed_names = set(self.hashed_files.values())
+        pending = []
+        for name in names:
+            if not compressor.should_compress(name):
+                continue
+            path = self.path(name)
+            content_hash = self.content_hash(name, hashed_names)
+            self.seen['compressed'].add(name)
+            entry = self.hash_cache['compressed'].get(name)
+            if (
+                entry and content_hash and entry[:2] == [os.path.getsize(path), content_hash]
+                and all(os.path.exists(self.path(compressed)) for compressed in entry[2])
+            ):
+                self.saved_seconds += entry[3]
+                self.reused['compressed'] += 1
+                continue
+            pending.append((name, path, content_hash))
+
+        def compress(name, path, content_hash):
+            start = time.monotonic()
+            size = os.path.getsize(path)
+            prefix_len = len(path) - len(name)
+            compressed = [compressed_path[prefix_len:] for compressed_path in compressor.compress(path)]
+            return name, [size, content_hash, compressed, time.monotonic() - start]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for name, entry in executor.map(lambda args: compress(*args), pending):
+                self.hash_cache['compressed'][name] = entry
+                for compressed in entry[2]:
+                    yield name, compressed
+
+    def content_hash(self, name, hashed_names):
+        """
+        What identifies the content of a collected file, or None if unknown.
+
+        Hashed names already change with the content (Django rewrites hashed
+        stylesheets on every run, so their hash isn't in the cache); other
+        files are copies of a source hashed by hash_sources().
+        """
+        if name in hashed_names:
+            return name
+        entry = self.hash_cache['hashes'].get(name)
+        return entry[2] if entry and name in self.seen['hashes'] else None
+
+    def log(self, message):
+        # collectstatic doesn't pass its stdout to the storage
+        sys.stdout.write(f'{message}\n')
@@ -0,0 +1,38 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from apps.products.images import get_image_variants, derivative_url, original_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(image_path, alt='', sizes='100vw', **attrs):
+    """
+    Responsive <picture> for a product image.
+
+    Emits WebP and JPEG srcsets with the given sizes and the intrinsic
+    width/height, falling back to the original file when no derivatives
+    have been built. Extra keyword arguments (class, style, loading) are
+    added to the <img>.
+    """
+    attrs.setdefault('loading', 'lazy')
+    extra = format_html_join('', ' {}="{}"', sorted(attrs.items()))
+    entry = get_image_variants(image_path)
+    if not entry or not entry['variants']:
+        return format_html(
+            '<img src="{}" alt="{}" decoding="async"{}>',
+            original_url(image_path), alt, extra,
+        )
+    
+    variants = entry['variants']
+    largest = variants[-1]
+    webp_srcset = ', '.join(f"{derivative_url(v['webp'])} {v['width']}w" for v in variants)
+    jpeg_srcset = ', '.join(f"{derivative_url(v['jpeg'])} {v['width']}w" for v in variants)
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" decoding="async"{}>'
+        '</picture>',
+        webp_srcset, sizes,
+        derivative_url(largest['jpeg']), jpeg_srcset, sizes, largest['width'], largest['height'], alt, extra,
+    )
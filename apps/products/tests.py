@@ -1,3 +1,342 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from .cache import get_catalog_version
+from .catalog import get_catalog_snapshot
+from .facets import apply_product_change, decode_cursor, encode_cursor, get_facet_index
+from .images import static_url
+from .importer import import_rows
+from .models import CatalogVersion, Category, Product
+from .pictures import diff_pictures, manifest_is_current, save_manifest, scan_pictures, tree_fingerprint
+from .search import normalize, search_product_ids
 
-# Create your tests here.
+
+# Templates use {% static %}, which needs a manifest with the production storage
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def bump_elsewhere():
+    """Bump the catalog version the way another process does: in the database only"""
+    CatalogVersion.objects.update(version=F('version') + 1)
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class CatalogSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.product = Product.objects.create(
+            name='Oxford', category=cls.category, price=15000, size='50', color='црна',
+            stock_quantity=2, image_path='suits/Oxford.jpg',
+        )
+
+    def test_snapshot_is_kept_while_the_version_stays(self):
+        snapshot = get_catalog_snapshot()
+        self.assertIs(get_catalog_snapshot(), snapshot)
+
+    def test_rebuilds_when_another_process_bumps_the_version(self):
+        snapshot = get_catalog_snapshot()
+        self.assertEqual(snapshot.get(self.product.pk).price, Decimal('15000'))
+
+        # update() skips the signals, like a write made by another process
+        Product.objects.filter(pk=self.product.pk).update(price=12000)
+        bump_elsewhere()
+
+        fresh = get_catalog_snapshot()
+        self.assertIsNot(fresh, snapshot)
+        self.assertEqual(fresh.get(self.product.pk).price, Decimal('12000'))
+        # Requests that started with the old snapshot keep reading it unchanged
+        self.assertEqual(snapshot.get(self.product.pk).price, Decimal('15000'))
+
+    def test_sold_out_product_leaves_the_snapshot(self):
+        self.assertIsNotNone(get_catalog_snapshot().get(self.product.pk))
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0, availability=False)
+        bump_elsewhere()
+        self.assertIsNone(get_catalog_snapshot().get(self.product.pk))
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class FacetIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.product = Product.objects.create(
+            name='Oxford', category=cls.category, price=15000, size='50', color='црна',
+            stock_quantity=2, image_path='suits/Oxford.jpg',
+        )
+
+    def test_rebuilds_when_another_process_bumps_the_version(self):
+        index = get_facet_index()
+        self.assertEqual(index.search({'color': 'сина'})[0].count(), 0)
+
+        Product.objects.filter(pk=self.product.pk).update(color='сина')
+        bump_elsewhere()
+
+        self.assertEqual(get_facet_index().search({'color': 'сина'})[0].count(), 1)
+
+    def test_patch_replaces_the_index_instead_of_changing_it(self):
+        index = get_facet_index()
+        self.product.color = 'сина'
+        Product.objects.filter(pk=self.product.pk).update(color='сина')
+        bump_elsewhere()
+        apply_product_change(get_catalog_version(), self.product)
+
+        patched = get_facet_index()
+        self.assertIsNot(patched, index)
+        self.assertEqual(patched.search({'color': 'сина'})[0].count(), 1)
+        self.assertEqual(index.search({'color': 'сина'})[0].count(), 0)
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+
+        def product(name, description=''):
+            return Product.objects.create(
+                name=name, category=category, description=description, price=15000, size='50',
+                color='сива', stock_quantity=1, image_path=f'suits/{name}.jpg',
+            )
+        cls.grey_suit = product('Сив костум')
+        cls.shirt = product('Кошула', 'Бела кошула што оди со секој костум, вратоврска и елек за свечени прилики')
+        cls.dress = product('Венчаница Ружа')
+
+    def test_cyrillic_and_latin_spellings_fold_together(self):
+        for spelling in ('венчаница', 'ВЕНЧАНИЦА', 'venchanica', 'vencanica', 'venčanica'):
+            with self.subTest(spelling=spelling):
+                self.assertEqual(normalize(spelling), 'vencanica')
+        self.assertEqual(normalize('Џемпер, ѓердан!'), 'dzemper gerdan')
+
+    def test_finds_products_in_either_alphabet(self):
+        for query in ('венчаница', 'vencanica', 'venchanica', 'VENČANICA'):
+            with self.subTest(query=query):
+                self.assertEqual(search_product_ids(query), [self.dress.pk])
+
+    def test_prefixes_and_all_words_match(self):
+        self.assertEqual(search_product_ids('ven'), [self.dress.pk])
+        self.assertEqual(search_product_ids('siv kostum'), [self.grey_suit.pk])
+        self.assertEqual(search_product_ids('kostum ruza'), [])
+
+    def test_closer_match_ranks_first(self):
+        # Both mention a suit; the short name beats a word in a long description
+        self.assertEqual(search_product_ids('костум'), [self.grey_suit.pk, self.shirt.pk])
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        suits = Category.objects.create(name='Suit', name_mk='Костум', sort_rank=1)
+        dresses = Category.objects.create(name='Formal Dress', name_mk='Фустан', sort_rank=2)
+        for i, price in enumerate([9000, 15000, 9000, 30000, 12000, 15000, 5000]):
+            Product.objects.create(
+                name=f'Product {i}', category=suits if i % 2 else dresses, price=price, size='50',
+                color='црна', stock_quantity=1, image_path=f'suits/{i}.jpg',
+            )
+
+    def walk(self, sort, size=3):
+        """Pages of product ids and the cursor keys they start after, first to last"""
+        result = get_facet_index().search({}, sort=sort)[0]
+        pages, keys, key = [], [], None
+        while True:
+            products, next_key = result.page_after(key, size)
+            pages.append([product.pk for product in products])
+            keys.append(key)
+            if next_key is None:
+                return result, pages, keys
+            key = next_key
+
+    def test_pages_cover_each_sort_order(self):
+        by_price = list(Product.objects.order_by('price', 'pk').values_list('pk', flat=True))
+        expected = {
+            '': list(Product.objects.order_by('sort_rank', '-created_at', '-pk').values_list('pk', flat=True)),
+            'price_asc': by_price,
+            'price_desc': list(Product.objects.order_by('-price', '-pk').values_list('pk', flat=True)),
+        }
+        for sort, ids in expected.items():
+            with self.subTest(sort=sort):
+                result, pages, keys = self.walk(sort)
+                self.assertEqual([len(page) for page in pages], [3, 3, 1])
+                self.assertEqual(sum(pages, []), ids)
+
+    def test_previous_key_leads_back_page_by_page(self):
+        for sort in ('', 'price_asc', 'price_desc'):
+            with self.subTest(sort=sort):
+                result, pages, keys = self.walk(sort)
+                for i in range(1, len(keys)):
+                    self.assertEqual(result.previous_key(keys[i], 3), keys[i - 1])
+
+    def test_cursor_survives_the_round_trip(self):
+        key = (Decimal('9000.00'), 3)
+        self.assertEqual(decode_cursor(encode_cursor('price_asc', key), 'price_asc'), key)
+        # A cursor made for another order starts over
+        self.assertIsNone(decode_cursor(encode_cursor('price_asc', key), 'price_desc'))
+
+    @override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+    def test_tampered_cursor_shows_the_first_page(self):
+        token = encode_cursor('price_asc', ('NaN', 1))
+        self.assertIsNone(decode_cursor(token, 'price_asc'))
+        response = self.client.get(reverse('products:product_list'), {'sort': 'price_asc', 'cursor': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Product 6')
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0, STORAGES=PLAIN_STATIC_STORAGES)
+class CatalogPageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Suit', name_mk='Костум')
+        cls.product = Product.objects.create(
+            name='Oxford', category=category, price=15000, size='50', color='црна',
+            stock_quantity=2, image_path='suits/Oxford.jpg',
+        )
+
+    def assertShared(self, url):
+        # The first request renders the page, the second one is a page cache hit
+        for i in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'data-cart-form')
+            self.assertEqual(
+                set(response['Cache-Control'].split(', ')),
+                {'public', 'max-age=0', f's-maxage={settings.CATALOG_PAGE_MAX_AGE}'},
+            )
+            self.assertFalse(response.has_header('Set-Cookie'))
+            self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_product_list_is_shared_with_anonymous_visitors(self):
+        self.assertShared(reverse('products:product_list'))
+
+    def test_product_detail_is_shared_with_anonymous_visitors(self):
+        self.assertShared(reverse('products:product_detail', args=[self.product.pk]))
+
+    def test_cart_count_hands_out_the_csrf_token(self):
+        response = self.client.get(reverse('cart:cart_count'))
+        self.assertEqual(response.json()['count'], 0)
+        self.assertTrue(response.json()['csrf_token'])
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertIn('private', response['Cache-Control'])
+
+
+class ProductImageUrlTests(TestCase):
+    """Picture URLs with the production storage and a collectstatic manifest"""
+
+    def setUp(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        with open(os.path.join(static_root.name, 'staticfiles.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': '1.1', 'paths': {'products/suits/Navy Suit.jpg': 'products/suits/Navy Suit.3f2a1b9c0d4e.jpg'}}, f)
+        settings_override = override_settings(STATIC_ROOT=static_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        static_url.cache_clear()
+        self.addCleanup(static_url.cache_clear)
+
+    def test_picture_url_is_fingerprinted(self):
+        product = Product(image_path='suits/Navy Suit.jpg')
+        self.assertEqual(product.get_image_url(), '/static/products/suits/Navy%20Suit.3f2a1b9c0d4e.jpg')
+
+    def test_old_picture_url_redirects_to_the_hashed_name(self):
+        response = self.client.get('/static/products/suits/Navy%20Suit.jpg')
+        self.assertRedirects(
+            response, '/static/products/suits/Navy%20Suit.3f2a1b9c0d4e.jpg', fetch_redirect_response=False,
+        )
+        self.assertIn('max-age=86400', response['Cache-Control'])
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class ImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Category.objects.create(name='Suit', name_mk='Костум')
+
+    def test_import_moves_the_shared_catalog_version(self):
+        snapshot = get_catalog_snapshot()
+        version = CatalogVersion.objects.get().version
+
+        row = {'name': 'Oxford', 'category': 'suit', 'price': '15000', 'size': '50', 'color': 'црна', 'stock_quantity': '2'}
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = import_rows([(2, row)])
+
+        self.assertEqual(stats.created, 1)
+        self.assertGreater(CatalogVersion.objects.get().version, version)
+        product = Product.objects.get(name='Oxford')
+        self.assertIsNone(snapshot.get(product.pk))
+        self.assertEqual(get_catalog_snapshot().get(product.pk).price, Decimal('15000'))
+
+    def test_bad_price_is_a_row_error(self):
+        rows = [
+            (2, {'name': 'Oxford', 'category': 'suit', 'price': 'NaN', 'size': '50', 'color': 'црна', 'stock_quantity': '2'}),
+            (3, {'name': 'Derby', 'category': 'suit', 'price': 'Infinity', 'size': '50', 'color': 'црна', 'stock_quantity': '2'}),
+            (4, {'name': 'Tweed', 'category': 'suit', 'price': '18000', 'size': '50', 'color': 'црна', 'stock_quantity': '2'}),
+        ]
+        stats = import_rows(rows)
+
+        self.assertEqual((stats.created, stats.invalid), (1, 2))
+        self.assertEqual([line for line, message in stats.errors], [2, 3])
+        self.assertTrue(all(message.startswith('price:') for line, message in stats.errors))
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Tweed'])
+
+    def test_imported_products_are_searchable(self):
+        rows = [
+            (2, {'name': 'Венчаница Бела', 'category': 'suit', 'price': '30000', 'size': '50', 'color': 'бела', 'stock_quantity': '1'}),
+            (3, {'name': 'Oxford', 'category': 'suit', 'price': '15000', 'size': '50', 'color': 'црна', 'stock_quantity': '2'}),
+        ]
+        import_rows(rows, batch_size=1)
+        wedding = Product.objects.get(name='Венчаница Бела')
+        self.assertEqual(search_product_ids('venchanica'), [wedding.pk])
+
+        # An update re-indexes the product under its new description
+        import_rows([(2, {'name': 'Oxford', 'category': 'suit', 'description': 'Волнен костум'})])
+        self.assertEqual(search_product_ids('volnen'), [Product.objects.get(name='Oxford').pk])
+
+
+class PictureManifestTests(TestCase):
+
+    def setUp(self):
+        self.pictures_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pictures_dir.cleanup)
+        os.mkdir(os.path.join(self.pictures_dir.name, 'suits'))
+        self.write('suits/Oxford.jpg', b'oxford')
+
+    def write(self, path, content):
+        with open(os.path.join(self.pictures_dir.name, path), 'wb') as f:
+            f.write(content)
+
+    def seed(self):
+        files = scan_pictures(self.pictures_dir.name, ['suits'])
+        diff = diff_pictures(self.pictures_dir.name, files)
+        save_manifest(diff, tree_fingerprint(files), files)
+        return diff
+
+    def test_fresh_checkout_is_unchanged(self):
+        self.seed()
+        # A clone gives every file a new mtime but the same path and size
+        os.utime(os.path.join(self.pictures_dir.name, 'suits/Oxford.jpg'), ns=(0, 0))
+        files = scan_pictures(self.pictures_dir.name, ['suits'])
+        self.assertTrue(manifest_is_current(tree_fingerprint(files)))
+
+    def test_moved_picture_is_a_rename(self):
+        self.seed()
+        os.rename(
+            os.path.join(self.pictures_dir.name, 'suits/Oxford.jpg'),
+            os.path.join(self.pictures_dir.name, 'suits/Oxford Navy.jpg'),
+        )
+        self.write('suits/Derby.jpg', b'derby')
+
+        diff = self.seed()
+        self.assertEqual(diff.renamed, {'suits/Oxford.jpg': 'suits/Oxford Navy.jpg'})
+        self.assertEqual((diff.added, diff.removed), (['suits/Derby.jpg'], []))
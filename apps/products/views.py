@@ -1,143 +1,172 @@
-from django.shortcuts import render, get_object_or_404
+from django.http import Http404
+from django.shortcuts import render
+from django.conf import settings
 from django.core.paginator import Paginator
-from .models import Product, Category
+from django.utils.http import urlencode
+from apps.recommendations.copurchase import bought_together
+from .catalog import get_catalog_snapshot
+from .decorators import catalog_page, get_detail_product, product_last_modified, product_page_version, product_validator
+from .facets import (
+    get_facet_index, parse_price, encode_cursor, decode_cursor,
+    PRICE_BUCKETS, SIZE_ORDER, SORT_CHOICES,
+)
+from .models import Product
+from .search import search_product_ids
+from .similarity import get_similarity_index
 
 
+@catalog_page()
 def home(request):
     """Home page with featured products"""
-    # Exclude accessories from home page
-    featured_products = Product.objects.filter(
-        availability=True, 
-        is_featured=True
-    ).exclude(category__name='Accessory')[:6]
-    
-    new_products = Product.objects.filter(
-        availability=True, 
-        is_new=True
-    ).exclude(category__name='Accessory')[:6]
-    
-    popular_products = Product.objects.filter(
-        availability=True, 
-        is_popular=True
-    ).exclude(category__name='Accessory')[:6]
-    
-    categories = Category.objects.all()
-    
-    context = {
-        'featured_products': featured_products,
-        'new_products': new_products,
-        'popular_products': popular_products,
-        'categories': categories,
-    }
+    context = dict(get_catalog_snapshot().home_sections)
     return render(request, 'home.html', context)
 
 
+PRODUCTS_PER_PAGE = 12
+
+
+@catalog_page()
 def product_list(request):
     """Product listing with filters"""
-    from django.db.models import Case, When, Value, IntegerField
-    
-    products = Product.objects.filter(availability=True)
-    categories = Category.objects.all()
+    index = get_facet_index()
     
     # Get filter parameters
-    category_slug = request.GET.get('category')
-    size = request.GET.get('size')
+    filters = {
+        'category': request.GET.get('category'),
+        'size': request.GET.get('size'),
+        'color': request.GET.get('color'),
+        'price': request.GET.get('price'),
+    }
     min_price = request.GET.get('min_price')
     max_price = request.GET.get('max_price')
     search = request.GET.get('search')
+    sort = request.GET.get('sort', '')
+    if sort not in dict(SORT_CHOICES):
+        sort = ''
     
-    # Apply filters
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    if size:
-        products = products.filter(size=size)
-    
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
+    # Search and arbitrary price ranges narrow the set the facets work on
+    restrict = None
+    ranking = None
     if search:
-        products = products.filter(name__icontains=search)
-    
-    # Order products: prioritize dresses and suits, accessories last
-    products = products.annotate(
-        category_priority=Case(
-            When(category__name='Wedding Dress', then=Value(1)),
-            When(category__name='Formal Dress', then=Value(2)),
-            When(category__name='Suit', then=Value(3)),
-            When(category__name__icontains='Coat', then=Value(4)),
-            When(category__name='Accessory', then=Value(5)),
-            default=Value(6),
-            output_field=IntegerField(),
-        )
-    ).order_by('category_priority', '-created_at')
-    
-    # Pagination
-    paginator = Paginator(products, 12)  # 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Get unique sizes for filters and sort them logically
-    all_sizes_raw = Product.objects.values_list('size', flat=True).distinct()
-    # Remove duplicates and sort
-    all_sizes_set = set(all_sizes_raw)
-    
-    # Define size order for sorting
-    size_order = ['XS', 'S', 'M', 'L', 'XL', 'XXL', '36', '38', '40', '42', '44', '46', '48', '50', '52', '54', '56', 'универзална']
-    
-    # Sort sizes according to predefined order
-    all_sizes = sorted(all_sizes_set, key=lambda x: size_order.index(x) if x in size_order else 999)
+        ranking = search_product_ids(search)
+        restrict = index.ids_to_mask(ranking)
+    
+    if parse_price(min_price) is not None or parse_price(max_price) is not None:
+        base = index.all if restrict is None else index.all & restrict
+        restrict = index.price_range_mask(base, parse_price(min_price), parse_price(max_price))
+    
+    products, counts = index.search(filters, restrict, ranking, sort)
+    
+    # Pagination: numbered pages by default, keyset cursors when enabled or requested
+    cursor = request.GET.get('cursor')
+    page_obj = None
+    page_range = None
+    next_cursor = None
+    previous_cursor = None
+    if cursor is not None or settings.PRODUCT_LIST_CURSOR_PAGINATION:
+        key = decode_cursor(cursor, sort)
+        page_products, next_key = products.page_after(key, PRODUCTS_PER_PAGE)
+        if next_key is not None:
+            next_cursor = encode_cursor(sort, next_key)
+        if key is not None:
+            # An empty cursor is the first page
+            previous_key = products.previous_key(key, PRODUCTS_PER_PAGE)
+            previous_cursor = encode_cursor(sort, previous_key) if previous_key is not None else ''
+    else:
+        paginator = Paginator(products, PRODUCTS_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        page_products = page_obj.object_list
+        page_range = paginator.get_elided_page_range(page_obj.number, on_each_side=2, on_ends=1)
+    
+    # Facet values with the number of products each would show
+    categories = [
+        {'slug': slug, 'name_mk': name_mk, 'count': counts['category'].get(slug, 0)}
+        for slug, name_mk in index.categories
+    ]
+    all_sizes = [
+        {'value': size, 'count': counts['size'][size]}
+        for size in sorted(counts['size'], key=lambda x: SIZE_ORDER.index(x) if x in SIZE_ORDER else 999)
+    ]
+    all_colors = [
+        {'value': value, 'label': label, 'count': counts['color'][value]}
+        for value, label in Product.COLOR_CHOICES
+        if value in counts['color']
+    ]
+    price_ranges = [
+        {'value': key, 'label': label, 'count': counts['price'][key]}
+        for key, label, low, high in PRICE_BUCKETS
+        if key in counts['price']
+    ]
     
     # Build filter parameters string for pagination
-    filter_params_list = []
-    if category_slug:
-        filter_params_list.append(f'category={category_slug}')
-    if size:
-        filter_params_list.append(f'size={size}')
-    if min_price:
-        filter_params_list.append(f'min_price={min_price}')
-    if max_price:
-        filter_params_list.append(f'max_price={max_price}')
-    if search:
-        filter_params_list.append(f'search={search}')
-    filter_params = '&'.join(filter_params_list)
+    filter_params = urlencode({
+        key: value for key, value in [
+            ('category', filters['category']),
+            ('size', filters['size']),
+            ('color', filters['color']),
+            ('price', filters['price']),
+            ('min_price', min_price),
+            ('max_price', max_price),
+            ('search', search),
+            ('sort', sort),
+        ] if value
+    })
     
     context = {
+        'products': page_products,
         'page_obj': page_obj,
+        'page_range': page_range,
+        'cursor_mode': page_obj is None,
+        'has_cursor': bool(cursor),
+        'previous_cursor': previous_cursor,
+        'next_cursor': next_cursor,
+        'sort_choices': SORT_CHOICES,
+        'current_sort': sort,
         'categories': categories,
         'all_sizes': all_sizes,
-        'current_category': category_slug,
-        'current_size': size,
+        'all_colors': all_colors,
+        'price_ranges': price_ranges,
+        'current_category': filters['category'],
+        'current_size': filters['size'],
+        'current_color': filters['color'],
+        'current_price': filters['price'],
         'filter_params': filter_params,
     }
     return render(request, 'products/product_list.html', context)
 
 
+RELATED_PRODUCTS_LIMIT = 4
+
+
+@catalog_page(product_validator, product_last_modified, product_page_version)
 def product_detail(request, pk):
     """Product detail page"""
-    product = get_object_or_404(Product, pk=pk, availability=True)
+    product = get_detail_product(request, pk)
+    if product is None:
+        raise Http404('No Product matches the given query.')
     
-    # Get related products (same category)
-    related_products = Product.objects.filter(
-        category=product.category,
-        availability=True
-    ).exclude(pk=product.pk)[:4]
+    # Related products: the ones of the same category that look most alike
+    related_products = get_similarity_index().most_similar(
+        product.image_path,
+        get_catalog_snapshot().related(product),
+        RELATED_PRODUCTS_LIMIT,
+    )
     
     context = {
         'product': product,
+        'bought_together': bought_together(product.pk),
         'related_products': related_products,
     }
     return render(request, 'products/product_detail.html', context)
 
 
+@catalog_page()
 def about(request):
     """About page"""
     return render(request, 'about.html')
 
 
+@catalog_page()
 def contact(request):
     """Contact page"""
     return render(request, 'contact.html')
@@ -0,0 +1,201 @@
+"""
+"Bought together" recommendations mined from past orders.
+
+build_copurchases() streams the items of the orders placed since its last
+run, adds them to a sparse product x product co-occurrence table
+(CoPurchaseCount) and re-ranks the neighbors of just the products those
+orders touched (BoughtTogether). Pages then read the ranked neighbors of a
+product with one indexed lookup.
+"""
+import math
+import time
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations, groupby
+from operator import itemgetter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from apps.orders.models import Order, OrderItem
+from apps.products.catalog import get_catalog_snapshot
+from apps.products.models import catalog_changed
+from .models import BoughtTogether, CoPurchaseCount, CoPurchaseRun
+
+
+# Products shown per "bought together" section
+BOUGHT_TOGETHER_LIMIT = 4
+
+# Orders younger than this may still be committing with a lower id than an
+# order that is already visible, so they are left for the next run
+SETTLE_TIME = timedelta(minutes=1)
+
+WRITE_BATCH_SIZE = 1000
+
+
+def order_baskets(after_order_id, last_order_id, chunk_size):
+    """Yield the set of product ids of each order in the id range, streamed in chunks"""
+    rows = (
+        OrderItem.objects.filter(order_id__gt=after_order_id, order_id__lte=last_order_id, product__isnull=False)
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    for order_id, items in groupby(rows, key=itemgetter(0)):
+        yield {product_id for order_id, product_id in items}
+
+
+def count_pairs(baskets):
+    """
+    Co-occurrence counts of the baskets as a sparse {(product, other): orders}
+    matrix, symmetric and with the per-product order counts on the diagonal.
+    """
+    counts = Counter()
+    orders = 0
+    for basket in baskets:
+        orders += 1
+        for product_id in basket:
+            counts[product_id, product_id] += 1
+        for a, b in combinations(basket, 2):
+            counts[a, b] += 1
+            counts[b, a] += 1
+    return counts, orders
+
+
+def merge_counts(new_counts):
+    """
+    Add new counts to the stored matrix and return the full rows of the
+    touched products as {product: {other: orders}}.
+    """
+    touched = {product_id for product_id, other_id in new_counts}
+    rows = {}
+    for product_id, other_id, orders in (
+        CoPurchaseCount.objects.filter(product_id__in=touched)
+        .values_list('product_id', 'other_id', 'orders')
+    ):
+        rows.setdefault(product_id, {})[other_id] = orders
+
+    for (product_id, other_id), orders in new_counts.items():
+        row = rows.setdefault(product_id, {})
+        row[other_id] = row.get(other_id, 0) + orders
+
+    CoPurchaseCount.objects.bulk_create(
+        [
+            CoPurchaseCount(product_id=product_id, other_id=other_id, orders=rows[product_id][other_id])
+            for product_id, other_id in new_counts
+        ],
+        batch_size=WRITE_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['product', 'other'],
+        update_fields=['orders'],
+    )
+    return rows
+
+
+def rank_neighbors(rows, top_k):
+    """
+    Replace the BoughtTogether rows of the given products.
+
+    Neighbors are ranked by the cosine similarity of their order sets,
+    orders(a, b) / sqrt(orders(a) * orders(b)), so products that are simply
+    bought a lot don't show up next to everything.
+    """
+    neighbor_ids = {other_id for row in rows.values() for other_id in row} - rows.keys()
+    totals = {product_id: row.get(product_id, 0) for product_id, row in rows.items()}
+    totals.update(
+        CoPurchaseCount.objects.filter(product_id__in=neighbor_ids, other_id=F('product_id'))
+        .values_list('product_id', 'orders')
+    )
+
+    ranked = []
+    for product_id, row in rows.items():
+        scored = [
+            (orders / math.sqrt(totals[product_id] * totals[other_id]), orders, other_id)
+            for other_id, orders in row.items()
+            if other_id != product_id and totals.get(other_id)
+        ]
+        scored.sort(key=lambda entry: (-entry[0], -entry[1], entry[2]))
+        ranked += [
+            BoughtTogether(product_id=product_id, neighbor_id=other_id, rank=rank, score=score)
+            for rank, (score, orders, other_id) in enumerate(scored[:top_k], start=1)
+        ]
+
+    BoughtTogether.objects.filter(product_id__in=rows.keys()).delete()
+    BoughtTogether.objects.bulk_create(ranked, batch_size=WRITE_BATCH_SIZE)
+    return len(ranked)
+
+
+def build_copurchases(top_k=None, chunk_size=None, full=False):
+    """
+    Count the orders placed since the last run and re-rank the products they
+    contain; with full=True start over from the first order.
+
+    Runs in one transaction, so an interrupted run leaves the previous
+    results in place. Products that weren't ordered again keep their
+    ranking even though their neighbors' totals moved; a full run
+    recomputes everything. Returns (run, seconds); the run is unsaved when
+    there were no new orders. Don't start it twice at the same time.
+
+    Changed rankings move the shared catalog version on commit, so the web
+    workers drop their cached product and cart pages.
+    """
+    top_k = top_k or settings.COPURCHASE_TOP_K
+    chunk_size = chunk_size or settings.COPURCHASE_CHUNK_SIZE
+    start = time.monotonic()
+
+    with transaction.atomic():
+        if full:
+            BoughtTogether.objects.all().delete()
+            CoPurchaseCount.objects.all().delete()
+            CoPurchaseRun.objects.all().delete()
+            # Product pages show the neighbors, so their cached copies are stale now
+            transaction.on_commit(catalog_changed)
+
+        previous = CoPurchaseRun.objects.first()
+        after_order_id = previous.last_order_id if previous else 0
+        last_order_id = Order.objects.filter(
+            pk__gt=after_order_id, created_at__lt=timezone.now() - SETTLE_TIME
+        ).aggregate(last=Max('pk'))['last']
+
+        run = CoPurchaseRun(last_order_id=last_order_id or after_order_id)
+        if last_order_id is None:
+            return run, time.monotonic() - start
+
+        counts, run.orders = count_pairs(order_baskets(after_order_id, last_order_id, chunk_size))
+        if counts:
+            rows = merge_counts(counts)
+            rank_neighbors(rows, top_k)
+            run.products = len(rows)
+            if not full:
+                transaction.on_commit(catalog_changed)
+        run.save()
+
+    return run, time.monotonic() - start
+
+
+def bought_together(product_id, limit=BOUGHT_TOGETHER_LIMIT):
+    """Available products most often bought with a product"""
+    neighbor_ids = (
+        BoughtTogether.objects.filter(product_id=product_id)
+        .order_by('rank')
+        .values_list('neighbor_id', flat=True)
+    )
+    # Sold out neighbors are missing from the snapshot
+    return get_catalog_snapshot().hydrate(neighbor_ids)[:limit]
+
+
+def bought_together_with(product_ids, exclude=(), limit=BOUGHT_TOGETHER_LIMIT):
+    """
+    Available products most often bought with any of the given products,
+    their scores summed over the products they are neighbors of.
+    """
+    exclude = set(product_ids) | set(exclude)
+    available = get_catalog_snapshot().products
+    scores = Counter()
+    for neighbor_id, score in (
+        BoughtTogether.objects.filter(product_id__in=product_ids)
+        .values_list('neighbor_id', 'score')
+    ):
+        if neighbor_id not in exclude and neighbor_id in available:
+            scores[neighbor_id] += score
+    return [available[neighbor_id] for neighbor_id, score in scores.most_common(limit)]
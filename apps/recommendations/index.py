@@ -0,0 +1,143 @@
+from decimal import Decimal
+from apps.products.cache import get_catalog_version
+from apps.products.catalog import get_catalog_snapshot
+from apps.products.models import Product, Category
+from .models import RecommendationRule
+
+
+# Max recommendations shown per section in the cart
+SECTION_LIMIT = 4
+
+
+class Candidate:
+    """A recommended product with the discount of the rule that recommends it"""
+    __slots__ = ('product_id', 'discount', 'is_accessory')
+
+    def __init__(self, product_id, discount, is_accessory):
+        self.product_id = product_id
+        self.discount = discount
+        self.is_accessory = is_accessory
+
+
+def is_accessory_category(category):
+    """Accessories get their own section in the cart"""
+    return 'accessor' in category.slug.lower() or 'додато' in (category.name_mk or '').lower()
+
+
+class RecommendationIndex:
+    """
+    Active recommendation rules compiled into lookup tables.
+
+    Rules are ranked by their Meta ordering (priority first) and each rule
+    holds its ranked candidates, so answering a cart only walks the rules
+    matched by its items. Prices come from the catalog snapshot when the
+    recommendations are shown, so they always match the product pages.
+    """
+
+    def __init__(self, version, rules, by_category, by_product):
+        self.version = version
+        self.rules = rules              # rule rank -> list of Candidate
+        self.by_category = by_category  # trigger category id -> rule ranks
+        self.by_product = by_product    # trigger product id -> rule ranks
+
+    @classmethod
+    def build(cls, version):
+        rules = list(
+            RecommendationRule.objects.filter(is_active=True)
+            .prefetch_related('recommended_categories', 'recommended_products__category')
+        )
+
+        category_ids = {c.id for rule in rules for c in rule.recommended_categories.all()}
+        accessory_categories = {
+            c.id for c in Category.objects.filter(id__in=category_ids) if is_accessory_category(c)
+        }
+
+        # Available products of every recommended category, newest first
+        products_by_category = {}
+        for product_id, category_id in (
+            Product.objects.filter(availability=True, category_id__in=category_ids)
+            .order_by('-created_at')
+            .values_list('id', 'category_id')
+        ):
+            products_by_category.setdefault(category_id, []).append(product_id)
+
+        compiled = []
+        by_category = {}
+        by_product = {}
+        for rank, rule in enumerate(rules):
+            candidates = []
+            for category in rule.recommended_categories.all():
+                is_accessory = category.id in accessory_categories
+                for product_id in products_by_category.get(category.id, []):
+                    candidates.append(Candidate(product_id, rule.discount_percentage, is_accessory))
+            for product in rule.recommended_products.all():
+                if product.availability:
+                    candidates.append(Candidate(
+                        product.id, rule.discount_percentage, is_accessory_category(product.category),
+                    ))
+            compiled.append(candidates)
+
+            if rule.trigger_category_id:
+                by_category.setdefault(rule.trigger_category_id, []).append(rank)
+            if rule.trigger_product_id:
+                by_product.setdefault(rule.trigger_product_id, []).append(rank)
+
+        return cls(version, compiled, by_category, by_product)
+
+    def recommend(self, cart_items):
+        """Return (accessories, other) recommendation dicts for the given cart items"""
+        ranks = set()
+        product_ids_in_cart = set()
+        for item in cart_items:
+            product_ids_in_cart.add(item.product_id)
+            ranks.update(self.by_category.get(item.product.category_id, ()))
+            ranks.update(self.by_product.get(item.product_id, ()))
+
+        accessories = []
+        other = []
+        seen = set(product_ids_in_cart)
+        for rank in sorted(ranks):
+            for candidate in self.rules[rank]:
+                if candidate.product_id in seen:
+                    continue
+                section = accessories if candidate.is_accessory else other
+                if len(section) < SECTION_LIMIT:
+                    seen.add(candidate.product_id)
+                    section.append(candidate)
+            if len(accessories) >= SECTION_LIMIT and len(other) >= SECTION_LIMIT:
+                break
+
+        if not accessories and not other:
+            return [], []
+
+        products = get_catalog_snapshot().products
+
+        def hydrate(candidates):
+            recommendations = []
+            for c in candidates:
+                product = products.get(c.product_id)
+                if product is None:
+                    continue
+                discounted_price = product.price * (Decimal('100') - c.discount) / Decimal('100')
+                recommendations.append({
+                    'product': product,
+                    'discount': c.discount,
+                    'discounted_price': discounted_price,
+                    'savings': product.price - discounted_price,
+                })
+            return recommendations
+
+        return hydrate(accessories), hydrate(other)
+
+
+_index = None
+
+
+def get_recommendation_index():
+    """This worker's compiled index for the current catalog version"""
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        index = _index = RecommendationIndex.build(version)
+    return index
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.recommendations.copurchase import build_copurchases
+
+
+class Command(BaseCommand):
+    help = 'Count products bought together in new orders and re-rank their "bought together" products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=settings.COPURCHASE_TOP_K, help='Products kept per product')
+        parser.add_argument('--chunk-size', type=int, default=settings.COPURCHASE_CHUNK_SIZE, help='Order items read per round trip')
+        parser.add_argument('--full', action='store_true', help='Start over from the first order')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Counting products bought together...')
+        
+        run, seconds = build_copurchases(
+            top_k=options['top_k'],
+            chunk_size=options['chunk_size'],
+            full=options['full'],
+        )
+        
+        if run.pk is None:
+            self.stdout.write(self.style.SUCCESS(f'[OK] No new orders since order #{run.last_order_id}'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Counted {run.orders} orders up to #{run.last_order_id} and ranked '
+            f'{run.products} products in {seconds:.1f}s'
+        ))
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_stock_quantity'),
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.PositiveIntegerField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('products', models.PositiveIntegerField(default=0, help_text='Products whose neighbors were recomputed')),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-finished_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BoughtTogether',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bought_together', to='products.product')),
+            ],
+            options={
+                'ordering': ['product', 'rank'],
+                'indexes': [models.Index(fields=['product', 'rank'], name='bought_together_rank_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CoPurchaseCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='copurchase_count_pair_unique')],
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
-from apps.products.models import Product, Category
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from apps.products.models import Product, Category, catalog_changed
 
 
 class RecommendationRule(models.Model):
@@ -58,3 +60,62 @@ class RecommendationRule(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.get_rule_type_display()})"
+
+
+
+class CoPurchaseCount(models.Model):
+    """
+    Number of orders that contained both products.
+
+    The sparse co-occurrence matrix of the co-purchase job, stored in both
+    directions; the diagonal (product == other) counts the orders with the
+    product at all.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_count_pair_unique'),
+        ]
+
+
+class BoughtTogether(models.Model):
+    """Top co-purchased products of a product, ranked by the co-purchase job"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bought_together')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='bought_together_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id} (#{self.rank})"
+
+
+class CoPurchaseRun(models.Model):
+    """A run of the co-purchase job; the last one tells where the next starts"""
+    last_order_id = models.PositiveIntegerField()
+    orders = models.PositiveIntegerField(default=0)
+    products = models.PositiveIntegerField(default=0, help_text="Products whose neighbors were recomputed")
+    finished_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-finished_at']
+
+
+@receiver([post_save, post_delete], sender=RecommendationRule)
+@receiver(m2m_changed, sender=RecommendationRule.recommended_products.through)
+@receiver(m2m_changed, sender=RecommendationRule.recommended_categories.through)
+def rules_changed(sender, **kwargs):
+    """
+    Move to a new catalog version once a rule change is committed, so every
+    worker rebuilds its cart recommendation index; product and category
+    changes move it already.
+    """
+    transaction.on_commit(catalog_changed)
@@ -1,3 +1,45 @@
-from django.test import TestCase
+from decimal import Decimal
+from django.db.models import F
+from django.test import TestCase, override_settings
+from apps.cart.models import CartItem
+from apps.products.models import CatalogVersion, Category, Product
+from .index import get_recommendation_index
+from .models import RecommendationRule
 
-# Create your tests here.
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class RecommendationIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        suits = Category.objects.create(name='Suit', name_mk='Костум')
+        accessories = Category.objects.create(name='Accessory', name_mk='Додатоци')
+        cls.suit = Product.objects.create(
+            name='Oxford', category=suits, price=15000, size='50', color='црна',
+            stock_quantity=2, image_path='suits/Oxford.jpg',
+        )
+        cls.tie = Product.objects.create(
+            name='Tie', category=accessories, price=2000, size='универзална', color='црна',
+            stock_quantity=5, image_path='accessories/Tie.jpg',
+        )
+        rule = RecommendationRule.objects.create(
+            name='Suit accessories', rule_type='category_based', trigger_category=suits, discount_percentage=10,
+        )
+        rule.recommended_categories.add(accessories)
+
+    def recommend(self):
+        accessories, other = get_recommendation_index().recommend([CartItem(product=self.suit)])
+        return accessories
+
+    def test_prices_follow_price_changes_made_elsewhere(self):
+        [recommendation] = self.recommend()
+        self.assertEqual(recommendation['discounted_price'], Decimal('1800'))
+
+        # Like a feed import in another process: no signals, only the shared version moves
+        Product.objects.filter(pk=self.tie.pk).update(price=3000)
+        CatalogVersion.objects.update(version=F('version') + 1)
+
+        [recommendation] = self.recommend()
+        self.assertEqual(recommendation['product'].price, Decimal('3000'))
+        self.assertEqual(recommendation['discounted_price'], Decimal('2700'))
+        self.assertEqual(recommendation['savings'], Decimal('300'))
@@ -5,12 +5,15 @@ set -o errexit
 # Install dependencies
 pip install -r requirements.txt
 
-# Collect static files
+# Generate resized product images (only changed pictures are processed)
+python manage.py build_image_derivatives
+
+# Collect static files (unchanged files reuse their cached hash and compressed copies)
 python manage.py collectstatic --no-input
 
 # Run migrations
 python manage.py migrate
 
-# Seed products (only if database is empty)
+# Seed products (skipped when pictures/ is unchanged since the last deploy)
 python manage.py seed_products || true
 
@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'apps.products.middleware.ProductImageRedirectMiddleware',  # Old product image URLs -> hashed names
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files in production
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +84,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'apps.cart.context_processors.cart_count',  # Add cart count to all templates
+                'apps.products.context_processors.page_cache',  # Must come after the csrf processor
             ],
         },
     },
@@ -122,6 +124,10 @@ if config('USE_SQLITE', default=False, cast=bool):
         }
     }
 
+# Sessions are read through the cache, so cached pages don't need a query
+# to load the session of visitors with a cart
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -167,13 +173,69 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
-# WhiteNoise static files storage for production
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Resized WebP/JPEG product images (python manage.py build_image_derivatives)
+IMAGE_DERIVATIVES_ROOT = BASE_DIR / 'derivatives'
+if IMAGE_DERIVATIVES_ROOT.exists():
+    STATICFILES_DIRS.append(('derivatives', IMAGE_DERIVATIVES_ROOT))
+
+# Feature vectors of the product pictures for "similar looks"
+# (python manage.py build_image_features); not served
+IMAGE_FEATURES_ROOT = BASE_DIR / 'image_features'
+
+# WhiteNoise static files storage for production: hashed names and
+# gzip/brotli copies, skipping files unchanged since the last collectstatic
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'apps.products.storage.CachedCompressedManifestStaticFilesStorage'},
+}
+# Hashes and compressed outputs of the last collectstatic, by file name, size and content
+STATICFILES_HASH_CACHE = BASE_DIR / 'staticfiles_cache.json'
 
 # Media files (Product images)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'pictures'
 
+# Product listing pagination: numbered pages, or keyset cursors that cost
+# the same on every page (cursors can also be requested with ?cursor=)
+PRODUCT_LIST_CURSOR_PAGINATION = config('PRODUCT_LIST_CURSOR_PAGINATION', default=False, cast=bool)
+
+# Seconds a reverse proxy/CDN may serve an anonymous catalog page before
+# revalidating it (browsers always revalidate, and get 304s while unchanged)
+CATALOG_PAGE_MAX_AGE = config('CATALOG_PAGE_MAX_AGE', default=60, cast=int)
+
+# Abandoned anonymous carts idle for this many days are deleted by
+# manage.py cleanup_carts, together with expired sessions
+CART_TTL_DAYS = config('CART_TTL_DAYS', default=30, cast=int)
+CART_CLEANUP_BATCH_SIZE = config('CART_CLEANUP_BATCH_SIZE', default=500, cast=int)
+CART_CLEANUP_BATCH_DELAY = config('CART_CLEANUP_BATCH_DELAY', default=0.2, cast=float)  # Seconds between batches
+
+# Also run the cleanup inside the web workers every N seconds (0 = off),
+# only outside business hours (local time, [start, end) hours)
+CART_CLEANUP_INTERVAL = config('CART_CLEANUP_INTERVAL', default=0, cast=int)
+CART_CLEANUP_BUSINESS_HOURS = (8, 21)
+
+# Each process has its own in-memory cache. Everything kept in it is keyed
+# by the catalog version, which lives in the database (products.CatalogVersion)
+# so a change made by any worker or management command reaches all of them.
+# State that must be shared between processes (versions, locks) has to be kept
+# in the database, or CACHES must point at a shared backend such as Redis.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+# Seconds a worker keeps using the catalog version it last read before asking
+# the database again; changes made elsewhere show up within this time
+CATALOG_VERSION_CHECK_INTERVAL = config('CATALOG_VERSION_CHECK_INTERVAL', default=1, cast=float)
+
+# Seconds rendered catalog pages stay in the page cache for anonymous
+# visitors; catalog changes invalidate them right away
+CATALOG_PAGE_CACHE_TIMEOUT = config('CATALOG_PAGE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Products kept per product by manage.py build_copurchases ("bought together"),
+# and order items read from the database per round trip while counting
+COPURCHASE_TOP_K = config('COPURCHASE_TOP_K', default=8, cast=int)
+COPURCHASE_CHUNK_SIZE = config('COPURCHASE_CHUNK_SIZE', default=2000, cast=int)
+
 # Login URLs
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'products:home'